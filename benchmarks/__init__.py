@@ -0,0 +1,21 @@
+"""headless benchmarks, run from the repo root with `python -m benchmarks.<name>`"""
+import os
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from project import Project
+from ui.core import UIEngine
+
+def headless(display_size=(1600, 900), **kwargs) -> UIEngine:
+    """starts (or reuses) a UIEngine on the SDL dummy driver and registers it as Project.UI so stages can find it"""
+    if not hasattr(Project, "UI"):
+        Project.UI = UIEngine(display_size, **kwargs)
+    return Project.UI
+
+def timed(func, *args):
+    """returns how long func(*args) took in ms"""
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1000
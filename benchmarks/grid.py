@@ -0,0 +1,52 @@
+"""laying out and resizing a 100x100 grid of buttons, GridLayout vs nested BoxLayouts"""
+import statistics
+
+import pygame
+
+from benchmarks import headless, timed
+import ui.base
+import ui.pos
+import ui.stock
+
+ROWS = COLS = 100
+REPEATS = 9
+LAYOUT_TARGET = 5 #ms, relaying out a GridLayout where nothing changed should be close to free
+RESIZE_TARGET = 10 #ms, and a window resize that moves every cell shouldn't cost much more than touching each once
+
+def nested(uii):
+    grid = ui.base.UIContainer(uii, ui.pos.BoxLayout("vertical"))
+    for i in range(ROWS):
+        row = ui.base.UIContainer(uii, ui.pos.BoxLayout("horizontal"))
+        row.add_elements({j : ui.stock.Button(uii, str(j), None) for j in range(COLS)})
+        grid.add_elements({i : row})
+    return grid
+
+def table(uii):
+    return ui.base.UIContainer(uii, ui.pos.GridLayout(ROWS, COLS)).add_elements(
+        {i : ui.stock.Button(uii, str(i % COLS), None) for i in range(ROWS * COLS)})
+
+def run(build):
+    uii = headless()
+    grid = build(uii)
+    uii.add({"grid" : grid})
+    uii.handle_reflow() #measures every button's text once, not what's being timed
+    layout = statistics.median(timed(lambda: (grid.reflow(), uii.handle_reflow())) for _ in range(REPEATS))
+    resizes = []
+    for i in range(REPEATS):
+        size = (1280, 720) if i % 2 else (1600, 900)
+        uii.display = pygame.display.set_mode(size, pygame.RESIZABLE)
+        pygame.event.post(pygame.Event(pygame.VIDEORESIZE, size=size, w=size[0], h=size[1]))
+        uii.handle_events()
+        resizes.append(timed(uii.handle_reflow))
+    resize = statistics.median(resizes)
+    grid.delete()
+    uii.tick()
+    return layout, resize
+
+if __name__ == "__main__":
+    for name, build in (("BoxLayout", nested), ("GridLayout", table)):
+        layout, resize = run(build)
+        print(f"{name:>10} {ROWS*COLS} cells: {layout:.2f} ms layout, {resize:.2f} ms resize")
+        if build is table: 
+            assert layout < LAYOUT_TARGET, f"GridLayout relayout took {layout:.2f} ms, target is {LAYOUT_TARGET} ms"
+            assert resize < RESIZE_TARGET, f"GridLayout resize took {resize:.2f} ms, target is {RESIZE_TARGET} ms"
@@ -0,0 +1,76 @@
+"""bytes allocated per element when building the stages/stress.py grid
+
+pass -b/--baseline with a git revision to measure that revision too and print both figures,
+e.g. `python -m benchmarks.memory -b 8a62143~1` compares against the tree before the element classes got __slots__
+"""
+import argparse
+import gc
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+from benchmarks import headless
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run():
+    uii = headless()
+    uii.smanager.parse_stages()
+    uii.tick()
+    gc.collect()
+    tracked = len(uii.tracker)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    uii.smanager.switch_stage("stress")
+    uii.tick()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    elements = len(uii.tracker) - tracked
+    #everything the stage switch left allocated, the elements plus whatever bookkeeping the engine keeps for them
+    grown = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return elements, grown
+
+def run_at(revision):
+    """runs this benchmark against another git revision and returns its (elements, grown)\n
+    #how it works: checks the revision out into a throwaway worktree, drops the current copy of this file in (older trees don't have it)
+    and runs it there in a fresh interpreter so the two measurements can't share imported modules"""
+    tmp = tempfile.mkdtemp()
+    tree = os.path.join(tmp, "tree")
+    try:
+        subprocess.run(["git", "worktree", "add", "--detach", tree, revision], cwd=ROOT, check=True, capture_output=True)
+        shutil.copy(os.path.abspath(__file__), os.path.join(tree, "benchmarks", "memory.py"))
+        out = subprocess.run([sys.executable, "-m", "benchmarks.memory", "--raw"], cwd=tree, check=True, capture_output=True, text=True).stdout
+        #the older tree may print its own chatter, only trust the tagged line
+        _, elements, grown = [line for line in out.splitlines() if line.startswith("memory ")][-1].split()
+        return int(elements), int(grown)
+    finally:
+        subprocess.run(["git", "worktree", "remove", "--force", tree], cwd=ROOT, capture_output=True)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def report(label, elements, grown):
+    print(f"{label:>8}: {elements} elements, {grown/1024:.0f} KiB, {grown/elements:.0f} bytes per element")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-b", "--baseline", help="git revision to measure as well, e.g. the commit before __slots__")
+    parser.add_argument("--raw", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    elements, grown = run()
+    if args.raw:
+        print("memory", elements, grown)
+        return
+    if args.baseline:
+        base_elements, base_grown = run_at(args.baseline)
+        report(args.baseline, base_elements, base_grown)
+        report("current", elements, grown)
+        base, new = base_grown / base_elements, grown / elements
+        print(f"{base - new:.0f} bytes per element saved ({new / base - 1:+.0%})")
+    else:
+        report("current", elements, grown)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""layout cost of a single keystroke into an EntryBox as the rest of the tree grows"""
+import pygame
+
+from benchmarks import headless, timed
+import ui.base
+import ui.pos
+import ui.stock
+
+KEYSTROKES = 50
+
+def run(rows):
+    uii = headless()
+    grid = ui.base.UIContainer(uii, ui.pos.BoxLayout("vertical"))
+    for i in range(rows):
+        row = ui.base.UIContainer(uii, ui.pos.BoxLayout("horizontal"))
+        row.add_elements({j : ui.stock.Button(uii, str(j+i*40), None) for j in range(40)})
+        grid.add_elements({i : row})
+    ebox = ui.stock.EntryBox(uii)
+    panel = ui.base.UIContainer(uii, ui.pos.BoxLayout("horizontal")).add_elements({
+        "label" : ui.stock.TextLabel(uii, "Type: "),
+        "ebox" : ebox}).place(ui.pos.Alignment.TOP_LEFT)
+    uii.add({"grid" : grid, "panel" : panel})
+    uii.tick()
+    uii.get_kb_focus(ebox)
+    
+    total = 0
+    for i in range(KEYSTROKES):
+        ebox.on_keystroke(pygame.Event(pygame.KEYDOWN, key=pygame.K_a, unicode="a"))
+        total += timed(uii.handle_reflow)
+        uii.render()
+    grid.delete()
+    panel.delete()
+    uii.tick()
+    return total / KEYSTROKES
+
+if __name__ == "__main__":
+    for rows in (1, 10, 30, 100):
+        print(f"{rows*40:>6} buttons: {run(rows):.3f} ms layout per keystroke")
@@ -0,0 +1,187 @@
+"""scripted frame-by-frame scenarios over the real stages, recording per-phase timings and allocations as JSON
+\n `python -m benchmarks.run -o results.json` to record, then `python -m benchmarks.run -c results.json` on a later tree
+to fail (exit code 1) if any scenario's p95 frame time regressed by more than --threshold"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pygame
+
+from benchmarks import headless
+import ui.core
+import ui.stock
+
+PHASES = ("handle_events", "update", "handle_reflow", "render", "cleanup")
+
+# ------ scenarios
+#each one is a generator taking the engine, the runner ticks one frame every time it yields
+#they all start and must finish on the "start" stage with nothing else left in the tree
+
+def back_to_start(uii):
+    if uii.smanager.current_stage is not uii.smanager.stages["start"]: uii.smanager.switch_stage("start")
+
+def stress(uii, frames):
+    """building the stages/stress.py grid, then sitting on it"""
+    uii.smanager.switch_stage("stress")
+    for _ in range(frames): yield
+    back_to_start(uii)
+    yield
+
+def stage_switch(uii, frames):
+    """flipping between the start and stress stages every frame"""
+    for i in range(frames):
+        uii.smanager.switch_stage("stress" if i % 2 == 0 else "start")
+        yield
+    back_to_start(uii)
+    yield
+
+def hover(uii, frames):
+    """dragging the mouse diagonally across the stress grid, hovering a new button most frames"""
+    uii.smanager.switch_stage("stress")
+    yield
+    grid = uii["stress"]._rect
+    for i in range(frames):
+        t = i / max(1, frames - 1)
+        pygame.mouse.set_pos((grid.left + t * grid.width, grid.top + t * grid.height))
+        yield
+    pygame.mouse.set_pos((0, 0))
+    back_to_start(uii)
+    yield
+
+def typing(uii, frames):
+    """typing into a focused EntryBox, one keystroke per frame"""
+    ebox = ui.stock.EntryBox(uii)
+    uii.add({"bench_ebox" : ebox})
+    yield
+    uii.get_kb_focus(ebox)
+    for i in range(frames):
+        char = "abcdefghij "[i % 11]
+        pygame.event.post(pygame.Event(pygame.KEYDOWN, key=pygame.key.key_code(char), unicode=char, mod=0, scancode=0))
+        yield
+    del uii["bench_ebox"]
+    yield
+
+def textlist(uii, frames):
+    """mouse wheel scrolling down a 100k line TextList"""
+    tlist = ui.stock.TextList(uii, [f"line {i}" for i in range(100_000)], max_lines=30)
+    uii.add({"bench_list" : tlist})
+    yield
+    pygame.mouse.set_pos(tlist._rect.center)
+    for _ in range(frames):
+        pygame.event.post(pygame.Event(pygame.MOUSEBUTTONDOWN, pos=tlist._rect.center, button=5))
+        yield
+    pygame.mouse.set_pos((0, 0))
+    del uii["bench_list"]
+    yield
+
+def resize(uii, frames):
+    """resizing the window every frame with the stress grid up"""
+    uii.smanager.switch_stage("stress")
+    yield
+    initial = uii.display.size
+    for i in range(frames):
+        size = (initial[0] - 40 * (i % 8), initial[1] - 30 * (i % 8))
+        uii.display = pygame.display.set_mode(size, pygame.RESIZABLE)
+        pygame.event.post(pygame.Event(pygame.VIDEORESIZE, size=size, w=size[0], h=size[1]))
+        yield
+    uii.display = pygame.display.set_mode(initial, pygame.RESIZABLE)
+    pygame.event.post(pygame.Event(pygame.VIDEORESIZE, size=initial, w=initial[0], h=initial[1]))
+    back_to_start(uii)
+    yield
+
+SCENARIOS = {func.__name__ : func for func in (stress, stage_switch, hover, typing, textlist, resize)}
+
+# ------ running
+
+def percentiles(samples) -> dict[str, float]:
+    samples = np.asarray(samples)
+    p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+    return {"mean" : float(samples.mean()), "p50" : float(p50), "p95" : float(p95), "p99" : float(p99), "max" : float(samples.max())}
+
+def drive(uii : ui.core.UIEngine, scenario, frames, on_frame=None):
+    """ticks a frame for every step of the scenario, calling on_frame() after each"""
+    for _ in scenario(uii, frames):
+        uii.tick()
+        uii.clock.tick() #uncapped, just so update() sees real frame times
+        if on_frame: on_frame()
+
+def run(name, frames) -> dict:
+    uii = headless()
+    scenario = SCENARIOS[name]
+
+    #timed pass
+    totals, phases = [], {phase : [] for phase in PHASES}
+    last = time.perf_counter()
+    def record():
+        nonlocal last
+        now = time.perf_counter()
+        totals.append((now - last) * 1000)
+        last = now
+        for phase in PHASES: phases[phase].append(uii.phase_times[phase])
+    drive(uii, scenario, frames, record)
+
+    #allocations get their own pass, tracemalloc slows everything down too much to time under it
+    tracemalloc.start()
+    blocks = tracemalloc.take_snapshot()
+    drive(uii, scenario, frames)
+    net = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(blocks, "filename"))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"frames" : len(totals),
+            "frame_ms" : percentiles(totals),
+            "phase_ms" : {phase : percentiles(times) for phase, times in phases.items()},
+            "alloc" : {"peak_kib" : peak / 1024, "net_kib" : net / 1024}}
+
+def compare(results, baseline, threshold) -> list[str]:
+    """names of the scenarios whose p95 frame time grew by more than threshold (a fraction) over baseline"""
+    regressed = []
+    print(f"{'scenario':>14} {'base p95':>10} {'new p95':>10} {'change':>8}")
+    for name, result in results["scenarios"].items():
+        if name not in baseline["scenarios"]: continue
+        base, new = baseline["scenarios"][name]["frame_ms"]["p95"], result["frame_ms"]["p95"]
+        change = new / base - 1 if base else 0.0
+        flag = " REGRESSED" if change > threshold else ""
+        if flag: regressed.append(name)
+        print(f"{name:>14} {base:>8.2f}ms {new:>8.2f}ms {change:>+7.0%}{flag}")
+    return regressed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", help="write results to this JSON file")
+    parser.add_argument("-c", "--compare", help="baseline JSON file to compare p95 frame times against")
+    parser.add_argument("-t", "--threshold", type=float, default=0.15, help="allowed p95 regression as a fraction (default 0.15)")
+    parser.add_argument("-f", "--frames", type=int, default=120, help="frames per scenario (default 120)")
+    parser.add_argument("scenarios", nargs="*", help=f"which scenarios to run, any of {', '.join(SCENARIOS)} (default all)")
+    args = parser.parse_args(argv)
+    for name in args.scenarios:
+        if name not in SCENARIOS: parser.error(f"unknown scenario {name}")
+
+    uii = headless()
+    uii.smanager.parse_stages()
+    uii.tick()
+    results = {"meta" : {"python" : platform.python_version(), "pygame" : pygame.version.ver, "frames" : args.frames,
+                         "machine" : platform.machine(), "time" : time.strftime("%Y-%m-%dT%H:%M:%S")},
+               "scenarios" : {}}
+    for name in args.scenarios or SCENARIOS:
+        result = results["scenarios"][name] = run(name, args.frames)
+        frame, alloc = result["frame_ms"], result["alloc"]
+        print(f"{name:>14}: p50 {frame['p50']:.2f}ms p95 {frame['p95']:.2f}ms max {frame['max']:.2f}ms, "
+              f"peak alloc {alloc['peak_kib']:.0f}KiB net {alloc['net_kib']:+.0f}KiB")
+
+    if args.output:
+        with open(args.output, "w") as f: json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)
+        regressed = compare(results, baseline, args.threshold)
+        if regressed:
+            print(f"p95 frame time regressed by more than {args.threshold:.0%} in: {', '.join(regressed)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,32 @@
+"""cost of a mouse wheel scroll on a VirtualTextList as list_ref grows"""
+from benchmarks import headless, timed
+import ui.stock
+
+SCROLLS = 200
+
+class Rows:
+    """stands in for a huge list without allocating it"""
+    def __init__(self, n):
+        self.n = n
+    def __len__(self):
+        return self.n
+    def __getitem__(self, idx):
+        return f"row {idx}"
+
+def run(n):
+    uii = headless()
+    tlist = ui.stock.VirtualTextList(uii, Rows(n), 400, max_lines=30)
+    uii.add({"list" : tlist})
+    uii.tick()
+    
+    total = 0
+    for i in range(SCROLLS):
+        tlist.on_scroll(False, True)
+        total += timed(uii.tick)
+    tlist.delete()
+    uii.tick()
+    return total / SCROLLS
+
+if __name__ == "__main__":
+    for n in (100, 10_000, 10_000_000):
+        print(f"{n:>10} rows: {run(n):.3f} ms per scrolled frame")
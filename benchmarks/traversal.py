@@ -0,0 +1,27 @@
+"""cost of walking and indexing the element tree, which hit testing, reflow and cleanup all lean on"""
+from benchmarks import headless, timed
+import ui.base
+import ui.pos
+import ui.stock
+
+REPEATS = 20
+
+def run(rows):
+    uii = headless()
+    grid = ui.base.UIContainer(uii, ui.pos.BoxLayout("vertical"))
+    for i in range(rows):
+        row = ui.base.UIContainer(uii, ui.pos.BoxLayout("horizontal"))
+        row.add_elements({j : ui.stock.Button(uii, str(j+i*40), None) for j in range(40)})
+        grid.add_elements({i : row})
+    buttons = [grid[i][j] for i in range(rows) for j in range(40)]
+
+    pre = sum(timed(lambda: sum(1 for _ in uii.df_traverse(grid))) for _ in range(REPEATS)) / REPEATS
+    post = sum(timed(lambda: sum(1 for _ in uii.df_traverse(grid, post=True))) for _ in range(REPEATS)) / REPEATS
+    z = timed(lambda: [uii.z_path(button) for button in buttons]) * 1000 / len(buttons)
+    lookup = timed(lambda: [grid[i][j] for i in range(rows) for j in range(40)]) * 1000 / len(buttons)
+    return pre, post, z, lookup
+
+if __name__ == "__main__":
+    for rows in (1, 10, 100, 250):
+        pre, post, z, lookup = run(rows)
+        print(f"{rows*40:>6} buttons: pre-order {pre:.3f} ms, post-order {post:.3f} ms, z_path {z:.2f} us, key lookup {lookup:.2f} us")
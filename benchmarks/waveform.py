@@ -0,0 +1,49 @@
+"""rasterising a 4K wide waveform graph, one pygame.draw.line per column vs Graphics.draw_columns"""
+import statistics
+
+import numpy as np
+import pygame
+
+from benchmarks import headless, timed
+from ui.style import Style
+import ui.util
+
+SIZE = (3840, 400)
+REPEATS = 15
+
+def spans():
+    """random min/max columns shaped like a real track's, as Waveform works them out"""
+    rng = np.random.default_rng(0)
+    envelope = np.abs(np.sin(np.linspace(0, 12, SIZE[0]))) * 0.9 + 0.05
+    maxs, mins = envelope * rng.uniform(0.5, 1, SIZE[0]), -envelope * rng.uniform(0.5, 1, SIZE[0])
+    mid = SIZE[1] // 2
+    return mid - maxs * mid, mid - mins * mid
+
+def lines(tops, bottoms):
+    graph = pygame.Surface(SIZE, pygame.SRCALPHA)
+    for x in range(graph.width):
+        pygame.draw.line(graph, Style.COLOURS.TEXT_NORMAL, (x, int(tops[x])), (x, int(bottoms[x])))
+    return graph
+
+def columns(tops, bottoms, antialias=False, stereo=False):
+    graph = pygame.Surface(SIZE, pygame.SRCALPHA)
+    if antialias: bottoms = np.maximum(bottoms, tops + 1)
+    else: tops, bottoms = tops.astype(int), bottoms.astype(int) + 1
+    ui.util.Graphics.draw_columns(graph, tops, bottoms, Style.COLOURS.TEXT_NORMAL)
+    if stereo: #as Waveform does it
+        layer = pygame.Surface(SIZE, pygame.SRCALPHA)
+        ui.util.Graphics.draw_columns(layer, tops + 20, bottoms - 20, Style.COLOURS.TEXT_HIGHLIGHTED)
+        layer.set_alpha(160)
+        graph.blit(layer, (0, 0))
+    return graph
+
+if __name__ == "__main__":
+    headless()
+    tops, bottoms = spans()
+    same = pygame.image.tobytes(lines(tops, bottoms), "RGBA") == pygame.image.tobytes(columns(tops, bottoms), "RGBA")
+    print(f"{SIZE[0]}x{SIZE[1]} graph, draw_columns matches the line loop pixel for pixel: {same}")
+    for name, func in (("draw.line loop", lambda: lines(tops, bottoms)),
+                       ("draw_columns", lambda: columns(tops, bottoms)),
+                       ("antialiased", lambda: columns(tops, bottoms, antialias=True)),
+                       ("stereo + aa", lambda: columns(tops, bottoms, antialias=True, stereo=True))):
+        print(f"{name:>15}: {statistics.median(timed(func) for _ in range(REPEATS)):.2f} ms")
@@ -12,16 +12,18 @@ from project import Project
 # except ImportError:
 #     pass
 
-sys.excepthook = zutil.crash_handler
-Project.settings.read()
-Project.UI = UIEngine((600, 600), display_idx=Project.settings.DISPLAY)
-Project.UI.smanager.parse_stages()
+if __name__ == "__main__": #worker processes (UIEngine.start_job(process=True)) import this module too
+    sys.excepthook = zutil.crash_handler
+    Project.settings.read()
+    Project.UI = UIEngine((600, 600), display_idx=Project.settings.DISPLAY, overlay=True)
+    Project.UI.smanager.parse_stages()
 
-try: #launch program
-    Project.UI.loop(pygame.display.get_current_refresh_rate())
-except Exception as e:
-    zutil.crash_handler(*sys.exc_info())
-finally: #after program
-    Project.settings.save()
-    pygame.quit()
-    sys.exit(0)
\ No newline at end of file
+    try: #launch program
+        Project.UI.loop(pygame.display.get_current_refresh_rate(), idle=True)
+    except Exception as e:
+        zutil.crash_handler(*sys.exc_info())
+    finally: #after program
+        Project.UI.close()
+        Project.settings.save()
+        pygame.quit()
+        sys.exit(0)
\ No newline at end of file
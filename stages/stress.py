@@ -8,12 +8,8 @@ UII = Project.UI
 
 class Stress(ui.core.Stage):
     def start(self):
-        self.grid = ui.base.UIContainer(UII, ui.pos.BoxLayout('vertical'))
-        for i in range(30):
-            row = ui.base.UIContainer(UII, ui.pos.BoxLayout('horizontal'))
-            for j in range(40):
-                row.add_elements({None:ui.stock.Button(UII, str(j+i*40), self.clickon_anything)})
-            self.grid.add_elements({i:row})
+        self.grid = ui.base.UIContainer(UII, ui.pos.GridLayout(30, 40))
+        self.grid.add_elements({i : ui.stock.Button(UII, str(i), self.clickon_anything) for i in range(30*40)})
         UII.add({"stress" : self.grid})
 
     def clickon_anything(self,_):
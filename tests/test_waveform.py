@@ -0,0 +1,26 @@
+"""a track that can't be decoded has to leave the Waveform showing an error, not take the ui loop down with it"""
+import time
+
+from benchmarks import headless
+import ui.custom
+import ui.util
+
+def test_corrupt_file(tmp_path):
+    uii = headless()
+    path = tmp_path / "corrupt.wav"
+    path.write_bytes(b"RIFF\x00\x00\x00\x00WAVEnot really audio" * 64)
+    wave = ui.custom.Waveform(uii, (400, 100), path)
+    uii.add({"wave" : wave})
+    deadline = time.perf_counter() + 60
+    while wave.error is None and time.perf_counter() < deadline:
+        uii.tick() #the job's callback runs in here, it used to raise
+        time.sleep(0.01)
+    del uii["wave"]
+    uii.tick()
+
+    assert isinstance(wave.error, ui.util.Exceptions.UIMediaException)
+    assert wave.error.__cause__ is not None
+    assert wave.loading and wave.peaks is None
+    assert wave.draw_surf().size == wave.graph.size #draws the error instead of the graph
+    wave.on_down((10, 10)) #and clicking it doesn't try to decode it again
+    assert not wave._decoding
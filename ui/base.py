@@ -2,7 +2,6 @@ from weakref import ref
 from typing import Callable, TYPE_CHECKING
 
 import pygame
-from bidict import bidict
 
 if TYPE_CHECKING: import ui.core
 import ui.pos
@@ -10,6 +9,13 @@ import ui.util
 from ui.style import Style
 
 class UIElement:
+    #slotted since a big layout holds thousands of these, subclasses should declare __slots__ for their own fields too
+    __slots__ = ("_id", "_uii", "_rect", "_pos", "_cache", "_measured", "_dirty", "_reflow_flag", "_keep_active", 
+                 "_parent", "istate", "__weakref__")
+    clips_children = False #whether children are only drawn and hit within this element's rect
+    sized_by_window = True #whether measure() can depend on the window size, elements that can't keep their memoized size through a resize
+    _children : tuple['UIElement', ...] = () #leaves share one empty tuple, containers get their own list
+
     def __eq__(self, value):
         return value._id == self._id
     def __hash__(self):
@@ -19,21 +25,19 @@ class UIElement:
     def __exit__(self, exc_type, exc_value, traceback):
         self.mark_dirty()
         self.reflow()
-    def __del__(self):
-        print(f"{self} gc'ed sucessfully.")
-    
     def __init__(self, ui_instance, **kwargs):
         self._id = ui_instance.get_unique_id()
         self._uii : 'ui.core.UIEngine' = ui_instance
         self._rect : pygame.Rect = kwargs.get("rect", None)
-        self._pos : ui.pos.Position = self.place()._pos
 
         self._cache : pygame.Surface = None
+        self._measured : tuple[int, int] = None
         self._dirty = True
         self._reflow_flag = True
+        self._keep_active = False
 
         self._parent : ref[UIContainer] = ref(kwargs["parent"]) if "parent" in kwargs else None
-        self._elements : bidict[str, UIElement] = bidict()
+        self._pos : ui.pos.Position = self.place()._pos #last, place() reflows elements that already have a rect
 
         self.istate = InteractionState()
         ui_instance.track(self)
@@ -44,22 +48,47 @@ class UIElement:
         anchor: where should we "stick" to on the parent?
         xy: offset for that point"""
         self._pos = ui.pos.Position(anchor, align, offset)
+        if self._rect is not None: self.reflow() #already laid out, the parent has to move it
         return self
 
     def measure(self) -> tuple[int, int]:
         """tells the parent container how big the element is"""
         raise NotImplementedError
     
+    def measured(self) -> tuple[int, int]:
+        """memoized measure(), what layouts should call
+        \n only re-measured after reflow(), mark_dirty(resize=True) or a window resize"""
+        if self._measured is None: self._measured = self.measure()
+        return self._measured
+
     def distribute(self, rect: pygame.Rect):
         """called by the parent container to tell it where to draw"""
-        if not self._rect or rect.size != self._rect.size: self.mark_dirty()
-        self._rect = rect
+        old, self._rect = self._rect, rect
+        self._reflow_flag = False
+        #only what the parent actually shows can be hit, a kid scrolled out of view keeps a stale rect over whatever's there now
+        shown = not self._parent or self._parent().shows(self)
+        if rect == old:
+            if shown and self not in self._uii.spatial: self._uii.spatial.update(self)
+            return
+        #both where it was and where it's going need recompositing
+        self._uii.damage(old)
+        self._uii.damage(rect)
+        if not old or rect.size != old.size: self._dirty = True
+        if shown: self._uii.spatial.update(self)
+        else: self._uii.spatial.remove(self)
 
     def reflow(self):
-        """bubbles up to the parent and causes a reflow of the entire subtree on the next frame"""
+        """queues the element to be re-laid out on the next frame
+        \n only climbs as far up the tree as the change in size actually reaches, see UIEngine.handle_reflow"""
         self._reflow_flag = True
-        #check for parent to avoid crashing trying to reflow on a component that hasn't been added to the tree yet + on root
-        if self._parent: self._parent().reflow()
+        self._uii.queue_reflow(self)
+        #a new size invalidates every ancestor's size too, stop early if they've already been invalidated
+        element = self
+        while element and element._measured is not None:
+            element._measured = None
+            parent = element._parent() if element._parent else None
+            if parent: parent._strategy.child_reflowed(element)
+            element = parent
 
     def delete(self):
         """queue the component for deletion
@@ -72,23 +101,77 @@ class UIElement:
         \nchildren get their cleanup() called separately"""
         pass
 
-    def mark_dirty(self):
-        """force the surface to redraw"""
+    def visible_children(self):
+        """the children that get drawn this frame, in draw order"""
+        return self._children
+
+    def shows(self, child : 'UIElement') -> bool:
+        """whether child is in visible_children(), override alongside it"""
+        return True
+
+    def is_shown(self) -> bool:
+        """whether every ancestor shows this element, i.e. it's drawn and can be hit wherever its rect says"""
+        element = self
+        while element._parent:
+            parent = element._parent()
+            if not parent.shows(element): return False
+            element = parent
+        return True
+
+    def child_at(self, point) -> 'UIElement':
+        """the kid under point, for containers whose layout indexes its own kids instead of the engine's spatial grid"""
+        return None
+
+    def mark_dirty(self, resize=False):
+        """force the surface to redraw
+        \n pass resize=True if the change can affect measure(), which also reflows the element"""
         self._dirty = True
+        self._uii.damage(self._rect)
+        if resize: self.reflow()
+
+    def mark_overlay_dirty(self, rect : pygame.Rect = None):
+        """recomposite the element without redrawing its cached surface, for when only what draw_overlay() draws has changed
+        \n rect (relative to the element) limits it to just that part, pass where the overlay was and where it's going"""
+        self._uii.damage(self._rect if rect is None else pygame.Rect(rect).move(self._rect.topleft).clip(self._rect))
 
     def draw_surf(self) -> pygame.Surface:
         """returns the pygame surface of the component"""
         return False
 
+    def draw_overlay(self, surface : pygame.Surface):
+        """draws straight onto the display over the cached draw_surf() result, every time the element's recomposited
+        \n for cheap parts that change often (cursors, playheads, labels) on top of an expensive static base,
+        so they only need mark_overlay_dirty() rather than mark_dirty(). surface is clipped to the element's rect, draw at screen coordinates"""
+        pass
+
     def render(self, surface):
         """draws the element to the input surface"""
-        drawn = self._cache = self.draw_surf() if self._dirty or not self._cache else self._cache
+        if self._dirty or not self._cache:
+            self._cache = self.draw_surf()
+            self._uii.metrics.count("redrawn")
+        drawn = self._cache
         self._dirty = False
         if drawn:
             surface.blit(drawn, self._rect.topleft)
+        if type(self).draw_overlay is not UIElement.draw_overlay:
+            clip = surface.get_clip()
+            surface.set_clip(clip.clip(self._rect))
+            self.draw_overlay(surface)
+            surface.set_clip(clip)
+
+    def activate(self, persistent=False):
+        """schedules update() to be called every frame, the engine does this whenever a hover/click fade starts
+        \n elements drop off the schedule once their fades settle, unless persistent (until deactivate() is called)"""
+        self._keep_active = self._keep_active or persistent
+        self._uii.activate(self)
+
+    def deactivate(self):
+        """lets a persistently active element drop off the update schedule once its fades settle"""
+        self._keep_active = False
 
     def update(self, dt):
-        """update internal state, must be called even if overridden"""
+        """update internal state, must be called even if overridden
+        \n only called while the element is active, see activate()"""
         self.istate.update(dt)
 
     #every input i could think of
@@ -97,7 +180,8 @@ class UIElement:
     def on_up(self): pass
     def on_enter(self): pass
     def on_exit(self): pass
-    def on_scroll(self, up, down): pass
+    def on_scroll(self, up, down): #unhandled scrolls bubble up to the parent
+        if self._parent: self._parent().on_scroll(up, down)
     def on_right(self) -> list[tuple[str, Callable]]: pass
     def on_keystroke(self, event : pygame.Event): pass
     def on_kb_focus (self): pass
@@ -106,18 +190,24 @@ class UIElement:
     def while_hovered(self, translated_mouse : tuple[int, int]): pass
 
 class UIContainer(UIElement):
+    __slots__ = ("_children", "_key_index", "_child_key", "_strategy", "_enable_bg")
+
     def __getitem__(self, key : str) -> UIElement:
-        return self._elements[key]
+        return self._children[self._key_index[key]]
     def __setitem__(self, key : str, value : UIElement):
         if key in self: raise ui.util.Exceptions.UILayoutException("Reassiging container elements isn't supported - delete and add again.")
         self.add_elements({key : value})
     def __delitem__(self, key : str):
-        self._elements[key].delete()
+        self[key].delete()
     def __contains__(self, key : str):
-        return key in self._elements
+        return key in self._key_index
 
     def __init__(self, ui_instance, strategy, enable_bg=True, **kwargs):
         super().__init__(ui_instance, **kwargs)
+        #kids in draw order, plus both directions of the key <-> kid mapping kept in sync with it
+        self._children : list[UIElement] = []
+        self._key_index : dict[str, int] = {}
+        self._child_key : dict[UIElement, str] = {}
         self._strategy : ui.pos.Strategy = strategy
         self._reflow_flag = True
         self._enable_bg = enable_bg
@@ -127,27 +217,53 @@ class UIContainer(UIElement):
     def add_elements(self, elements : dict[str, UIElement]):
         """add all components in the dict to the layout"""
         for key, element in elements.items():
-            if key is None: key = element._id
-            if key in self._elements: raise ui.util.Exceptions.UILayoutException(f"{key} used for 2 different elements in the same container!")
-            if element in self._elements.inverse: raise ui.util.Exceptions.UILayoutException(f"{element} added twice to the same container!")
-            if element._parent: raise ui.util.Exceptions.UILayoutException(f"{element} can't have 2 parents!")
-            element._parent = ref(self)
-            self._elements[key] = element
+            self._adopt(element._id if key is None else key, element)
         self.reflow()
         return self
     
+    def _adopt(self, key, element : UIElement):
+        """links a single child in without reflowing"""
+        if key in self._key_index: raise ui.util.Exceptions.UILayoutException(f"{key} used for 2 different elements in the same container!")
+        if element in self._child_key: raise ui.util.Exceptions.UILayoutException(f"{element} added twice to the same container!")
+        if element._parent: raise ui.util.Exceptions.UILayoutException(f"{element} can't have 2 parents!")
+        element._parent = ref(self)
+        self._key_index[key] = len(self._children)
+        self._child_key[element] = key
+        self._children.append(element)
+        self._strategy.invalidate()
+
+    def index(self, element : UIElement) -> int:
+        """position of the child in draw order"""
+        return self._key_index[self._child_key[element]]
+
+    def _remove_child(self, element : UIElement):
+        """unlinks a deleted child, called by UIEngine.cleanup()
+        \n cheapest for the last child, later siblings shift down a place"""
+        idx = self._key_index.pop(self._child_key.pop(element))
+        del self._children[idx]
+        for sibling in self._children[idx:]:
+            self._key_index[self._child_key[sibling]] -= 1
+        element._parent = None
+        self._strategy.invalidate()
+    
     # ------ implement layout system
 
     def measure(self):
-        return self._strategy.measure(self._elements.values())
+        return self._strategy.measure(self._children)
+
+    def child_at(self, point):
+        if not self._strategy.indexes_children: return None
+        child = self._strategy.child_at(self._children, point)
+        return child if child is not None and child._rect.collidepoint(point) else None
 
     def distribute(self, rect):
+        #a container that hasn't moved or been reflowed has nothing new to tell its kids
+        relayout = self._reflow_flag or rect != self._rect
         super().distribute(rect)
-        self._strategy.distribute(self._elements.values(), self._rect)
-        self._reflow_flag = False
+        if relayout: self._strategy.distribute(self._children, self._rect)
 
     def draw_surf(self):
-        return ui.util.Graphics.coloured_square(Style.COLOURS.FOREGROUND, self._rect.size, Style.ALPHA.LAYOUT) if self._enable_bg else None
+        return ui.util.Graphics.coloured_square(Style.COLOURS.FOREGROUND, self._rect.size, Style.ALPHA.LAYOUT, copy=False) if self._enable_bg else None
 
     def render(self, surface):
         super().render(surface)
@@ -157,6 +273,8 @@ class UIContainer(UIElement):
         return (("(TEST) delete layout", lambda x: self.delete()),)
 
 class InteractionState:
+    __slots__ = ("is_clicked", "is_hovered", "is_kb_focused", "keep_kb_focus", "click_percent", "hover_percent", "translated_mouse")
+
     def __init__(self):
         self.is_clicked = False
         self.is_hovered = False
@@ -165,7 +283,20 @@ class InteractionState:
         self.click_percent = 0
         self.hover_percent = 0
         self.translated_mouse : tuple[int, int] = None
+    def settled(self):
+        """true once both fades have reached the end they're heading towards"""
+        return (self.click_percent == (100 if self.is_clicked else 0) 
+                and self.hover_percent == (100 if self.is_hovered else 0))
     def update(self, dt):
         delta = dt/10/Style.TIME.FADE_TIME
         self.click_percent = max(0.0, min(100.0, self.click_percent+delta* (1 if self.is_clicked else -1) ))
         self.hover_percent = max(0.0, min(100.0, self.hover_percent+delta* (1 if self.is_hovered else -1) ))
+
+def _report_gc(element):
+    print(f"{element} gc'ed sucessfully.")
+
+def debug_gc(enabled=True):
+    """print whenever an element gets garbage collected, for hunting down leaked references
+    \n off by default, finalizers on every element slow collection down"""
+    if enabled: UIElement.__del__ = _report_gc
+    elif "__del__" in vars(UIElement): del UIElement.__del__
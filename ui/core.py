@@ -1,13 +1,17 @@
-import random
+import asyncio
 import time
 import importlib
 import os
-from typing import Callable, NoReturn
+import queue
+import warnings
+from concurrent.futures import Future
+from typing import Callable, Coroutine, NoReturn
 
 import numpy as np
 import pygame
 
 import ui.base
+import ui.metrics
 import ui.stock
 import ui.util
 import ui.pos
@@ -20,7 +24,7 @@ class Stage:
     \n instead, flow is to be directed with StageManager.transfer_stage(), StageManager.switch_stage(), StageManager.return_stage()"""
     def __init__(self):
         self._return_func = None
-    
+
     def start(self): 
         """executed when first entering the stage"""
         pass
@@ -50,6 +54,7 @@ class StageManager:
         self.stages : dict[str, Stage] = dict() 
         self.current_stage : Stage = None
         self.previous_stages : list[Stage] = []
+        self.cleanup_hooks : list[Callable[[Stage], None]] = [] #called with each stage right after its cleanup()
 
     def parse_stages(self, start_key="start"):
         for file in [file for file in os.listdir("stages/") if file.endswith(".py") and not file.startswith("__")]:
@@ -62,9 +67,9 @@ class StageManager:
         """switch to an entirely new stage, 
         ensuring all data from last stages are cleaned up 
         and no state is left lingering"""
-        for stage in self.previous_stages: stage.cleanup()
+        for stage in self.previous_stages: self._cleanup(stage)
         self.previous_stages = []
-        if self.current_stage: self.current_stage.cleanup()
+        if self.current_stage: self._cleanup(self.current_stage)
         self.current_stage = self.stages[stage_key]
         self.current_stage.start(*start_args)
 
@@ -83,12 +88,20 @@ class StageManager:
         """returns to the last suspended stage and executes its resume funcs
           if it exists else returns false"""
         if not self.previous_stages: return False
-        self.current_stage.cleanup()
+        self._cleanup(self.current_stage)
         self.current_stage = self.previous_stages.pop()
         self.current_stage.resume()
         return True
 
+    def _cleanup(self, stage : Stage):
+        stage.cleanup()
+        for hook in self.cleanup_hooks: hook(stage)
+
 class UIEngine:
+    WAKE_EVENT = pygame.event.custom_type() #posted to interrupt an idle sleep
+    ASYNC_SLICE = 5 #ms, longest input can go unnoticed while idling with coroutines in flight
+    REPAINT_EVENTS = (pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED, pygame.WINDOWFOCUSGAINED, pygame.WINDOWSHOWN, pygame.VIDEOEXPOSE)
+
     def __getitem__(self, key):
         return self.root.__getitem__(key)
     def __setitem__(self, key, value):
@@ -98,22 +111,59 @@ class UIEngine:
     def __delitem__(self, key : str):
         return self.root.__delitem__(key)
 
-    def __init__(self, display_size, display_idx=0, caption="", **kwargs):
+    def __init__(self, display_size, display_idx=0, caption="", damage_tracking=True, overlay=False, workers=4, processes=None, async_budget=2, **kwargs):
         pygame.init()
         self.display = pygame.display.set_mode(display_size, pygame.RESIZABLE | pygame.DOUBLEBUF, display=display_idx, vsync=1)
         self.display.fill(Style.COLOURS.BACKGROUND)
         pygame.display.flip()
         pygame.display.set_caption(caption or "MiniUI - you, and i.")
-    
+
         self.clock = pygame.Clock()
         self.tracker = set()
+        self.ids = ui.util.Pools.IdPool()
         self.detracker = dict() #has to preserve insertion orders
+        self.reflow_queue : dict[ui.base.UIElement, None] = dict()
+        self._full_reflow = True #lay out everything on the first frame
         self.focused_element : ui.base.UIElement = None
+        self.hovered_element : ui.base.UIElement = None
+        self.clicked_elements : set[ui.base.UIElement] = set()
+        self.active : dict[ui.base.UIElement, None] = dict() #elements that need update() called, insertion ordered
+        self.spatial = ui.pos.SpatialGrid()
         self.fonts = ui.util.Wrappers.FontWrapper()
         self.root = ui.base.UIContainer(self, ui.pos.StackLayout(), enable_bg=False)
         self.smanager = StageManager()
         self.running = True
-        self.bg_threads : set[ui.util.Wrappers.ThreadWrapper] = set()
+        self.workers = ui.util.Pools.WorkerPool(workers, notify=self.wake) #runs start_job() jobs
+        self.processes = ui.util.Pools.ProcessPool(processes, notify=self.wake, completed=self.workers.completed) #and start_job(process=True) ones
+        self.jobs : dict[Future, tuple[Callable, object]] = {} #unfinished jobs -> (callback, group)
+        self.smanager.cleanup_hooks.append(self.cancel_jobs)
+
+        #coroutines from run_async() share one asyncio loop, stepped during update() for at most async_budget ms a frame
+        self.aloop = asyncio.new_event_loop()
+        self.aloop.set_task_factory(self._task_factory)
+        self.async_budget = async_budget
+        self.tasks : dict[asyncio.Task, tuple[Callable, object]] = {} #unfinished tasks -> (callback, group), cancelled ones stay until they unwind
+        self._finished_tasks : list[asyncio.Task] = []
+        self._async_steps = [0] #times any task on the loop was resumed, see Wrappers.CountedCoroutine
+        self._async_busy = False #the last step_async() ran out of budget with coroutines still making progress
+        self.smanager.cleanup_hooks.append(self.cancel_tasks)
+        self.phase_times : dict[str, float] = {} #ms each phase of the last tick() took, by phase name
+        self.metrics = ui.metrics.Metrics()
+        self.metrics.watch_cache("squares", ui.util.Graphics.square_cache)
+        self.metrics.watch_cache("text_metrics", ui.util.Wrappers.CachedFont.metrics)
+        self.metrics.watch_cache("text_rasters", ui.util.Wrappers.CachedFont.rasters)
+        self.overlay = ui.metrics.Overlay(self.metrics, self.fonts[16]) if overlay else None #on screen timings
+
+        #damage tracking: only recomposite + present the screen regions that changed since last frame
+        self.damage_tracking = damage_tracking
+        self.damaged : list[pygame.Rect] = []
+        self.presented : list[pygame.Rect] = []
+
+        #idle mode: block on input instead of rendering frames nobody will see change
+        self.idle_time = 0.0 #total seconds spent asleep
+        self._sleeping = False
+        self._slept = 0 #ms spent asleep since the last frame
+        self._pending_events : list[pygame.Event] = [] #the event that woke the loop up
 
         self.event_listeners = {
             "rmb_down" : set(), #called with global coords
@@ -123,7 +173,7 @@ class UIEngine:
         }
 
     def track(self, element):
-        """called whenever a new element is created, tracks elements so a unique id is always issued and for debugging"""
+        """called whenever a new element is created, tracks elements for debugging"""
         self.tracker.add(element)            
     def add(self, element_dict : dict[str, ui.base.UIElement]):
         """shorthand for adding an element to root node"""
@@ -133,6 +183,25 @@ class UIEngine:
         if element._parent() in self.detracker: raise ui.util.Exceptions.UILayoutException("Tried to delete child of a parent that's already marked for deletion!")
         self.detracker[element] = None
 
+    def damage(self, rect : pygame.Rect):
+        """marks a screen region as needing to be recomposited on the next render"""
+        if rect is not None: self.damaged.append(pygame.Rect(rect))
+        if self._sleeping: self.wake()
+
+    def damage_all(self):
+        """marks the whole window as needing to be recomposited, for when the os may have thrown away what was on it"""
+        self.damage(self.display.get_rect())
+
+    def activate(self, element : ui.base.UIElement):
+        """called by UIElement.activate(), schedules the element's update() until it settles"""
+        self.active[element] = None
+        if self._sleeping: self.wake()
+
+    def queue_reflow(self, element : ui.base.UIElement):
+        """called whenever an element calls reflow(), the layout is actually recalculated once per frame"""
+        self.reflow_queue[element] = None
+        if self._sleeping: self.wake()
+
     def get_kb_focus(self, element : ui.base.UIElement):
         if self.focused_element:
             self.focused_element.istate.is_kb_focused = False
@@ -142,12 +211,7 @@ class UIEngine:
         self.focused_element.on_kb_focus()
 
     def get_unique_id(self):
-        used = {element._id for element in self.tracker}
-        while True:
-            colour = [random.randint(0, 96) for _ in range(3)]
-            colour_key = colour[0] << 16 | colour[1] << 8 | colour[2]
-            if colour_key not in used:
-                return colour_key
+        return self.ids.allocate()
             
     def add_event_listener(self, event_type : str, handler : Callable):
         """do NOT use lambdas as event listeners because they will cause the element to not get deleted properly"""
@@ -158,24 +222,108 @@ class UIEngine:
             
     def df_traverse(self, root : ui.base.UIContainer, post=False):
         """utility generator to perform depth-first traversal on a root note in either pre or post order"""
+        if not post:
+            stack = [root]
+            while stack:
+                element = stack.pop()
+                yield element
+                stack.extend(reversed(element._children))
+            return
         stack = [(root, False)]
         while stack:
             element, visited = stack.pop()
-            if visited or not post: yield element
-            if not visited:
-                if post: 
-                    stack.append((element, True))
-                    [stack.append((child, False)) for child in element._elements.values()]
-                else:
-                    [stack.append((child, False)) for child in reversed(element._elements.values())]
-
-    def start_job(self, func, cb=None, args=(), daemon=True):
-        """start func(*args) on a separate thread, then after it's done or errors out, calls cb(err, result) on the main thread"""
-        thread = ui.util.Wrappers.ThreadWrapper(func, args, cb)
-        if daemon: thread.daemon = True
-        self.bg_threads.add(thread)
-        thread.start()
-        return thread
+            if visited: yield element
+            else:
+                stack.append((element, True))
+                stack.extend((child, False) for child in element._children) #last child comes out first, so cleanup unlinks from the end
+
+    def render_traverse(self, root : ui.base.UIElement):
+        """pre-order traversal of what actually gets drawn, only descending into visible_children()
+        \n yields (element, clip) where clip is the rect clipping ancestors confine the element to, or None"""
+        stack = [(root, None)]
+        while stack:
+            element, clip = stack.pop()
+            yield element, clip
+            if element.clips_children: clip = element._rect if clip is None else element._rect.clip(clip)
+            stack.extend((child, clip) for child in reversed(element.visible_children()))
+
+    def z_path(self, element : ui.base.UIElement) -> list[int]:
+        """child indices from the root down to the element, 
+        comparing two paths gives their draw order (greater is drawn later, so on top)"""
+        path = []
+        while element._parent:
+            parent = element._parent()
+            path.append(parent.index(element))
+            element = parent
+        return path[::-1]
+
+    def clipped_out(self, element : ui.base.UIElement, point) -> bool:
+        """true if a clipping ancestor hides the element at point"""
+        while element._parent:
+            element = element._parent()
+            if element.clips_children and not element._rect.collidepoint(point): return True
+        return False
+
+    def hit_test(self, point) -> ui.base.UIElement:
+        """returns the top-most laid out element containing point, or None"""
+        hits = [hit for hit in self.spatial.query(point) if not self.clipped_out(hit, point)]
+        for hit in hits: #kids of layouts that index them (see GridLayout) aren't in the spatial grid, ask their parent
+            child = hit.child_at(point)
+            if child is not None: hits.append(child)
+        if len(hits) < 2: return hits[0] if hits else None
+        return max(hits, key=self.z_path)
+
+    def start_job(self, func, cb=None, args=(), daemon=None, priority=0, group=None, process=False) -> Future:
+        """run func(*args) on the worker pool, then after it's done or errors out, calls cb(err, result) on the main thread
+        \n higher priority jobs are started first. the job belongs to group, the current stage by default, 
+        and is cancelled when that stage is cleaned up. pass any other object as group to cancel it yourself with cancel_jobs()
+        \n process=True runs it in a worker process instead, for cpu bound work that would hold the GIL. func has to be a module level function 
+        and func, args and the result picklable, though numpy arrays in the result come back through shared memory (see Pools.ProcessPool)
+        \n daemon is ignored, it's only kept so older calls don't break. jobs run on the pool's threads now, which never hold up exit"""
+        if daemon is not None:
+            warnings.warn("start_job()'s daemon argument does nothing since jobs moved to a worker pool", DeprecationWarning, stacklevel=2)
+        future = (self.processes if process else self.workers).submit(func, args, priority)
+        self.jobs[future] = (cb, self.smanager.current_stage if group is None else group)
+        return future
+
+    def cancel_jobs(self, group):
+        """cancels every unfinished job in the group, jobs that already started run to completion but their callbacks never fire"""
+        for future, (_, job_group) in list(self.jobs.items()):
+            if job_group is group:
+                future.cancel()
+                del self.jobs[future]
+
+    def run_async(self, coro : Coroutine, cb=None, group=None) -> asyncio.Task:
+        """schedule a coroutine on the engine's asyncio loop, then once it returns or raises, calls cb(err, result) on the main thread
+        \n the loop only runs on the main thread between frames, so the coroutine can touch the ui directly but shouldn't block.
+        like start_job() the task belongs to the current stage by default and is cancelled when that stage is cleaned up"""
+        task = self.aloop.create_task(coro)
+        self.tasks[task] = (cb, self.smanager.current_stage if group is None else group)
+        task.add_done_callback(self._finished_tasks.append)
+        return task
+
+    def cancel_tasks(self, group):
+        """cancels every unfinished task in the group, their callbacks never fire"""
+        for task, (_, task_group) in list(self.tasks.items()):
+            if task_group is group:
+                task.cancel()
+                self.tasks[task] = (None, task_group) #kept until it unwinds so update() keeps stepping the loop
+
+    def _task_factory(self, loop, coro, **kwargs) -> asyncio.Task:
+        #every task on the loop, including ones coroutines start themselves, counts its steps into _async_steps
+        return asyncio.Task(ui.util.Wrappers.CountedCoroutine(coro, self._async_steps), loop=loop, **kwargs)
+
+    def step_async(self, budget : float):
+        """runs the asyncio loop's ready callbacks for up to budget ms, without waiting on anything
+        \n stops early once a pass resumes no task, whatever's left is waiting on io or a timer"""
+        deadline = time.perf_counter() + budget / 1000
+        while True:
+            steps = self._async_steps[0]
+            self.aloop.call_soon(self.aloop.stop) #sentinel marking the end of the pass, run_forever() then does a single non-blocking pass and returns
+            self.aloop.run_forever()
+            progressed = self._async_steps[0] != steps
+            self._async_busy = progressed and time.perf_counter() > deadline
+            if not progressed or self._async_busy: return
 
     ###################################################################################
     #split each frame step into its own function so the scope isn't littered with vars#
@@ -184,21 +332,25 @@ class UIEngine:
     def handle_events(self):
         #how it works:
         #-> boil down all pygame events incoming for the frame into a bunch of vars
-        #-> use those vars to traverse the entire tree and fire the respective handler depending on the state
-        #-> implements first hit detection for top-most elements - only hits one element
+        #-> look up the top-most element under the mouse in the spatial index - only hits one element
+        #-> fire the respective handlers on it, and on whichever elements lost hover/focus/click state
         #-> after all elements have had a chance to handle the events, then fire event listeners 
 
         #event aggregation
         lmb_down = lmb_up = rmb_down = resize = False
         scroll_up = keystroke = None
         mouse_pos = pygame.mouse.get_pos()
-        events =  pygame.event.get() if self.smanager.current_stage is None else self.smanager.current_stage.handle_events(pygame.event.get())
+        events = self._pending_events + pygame.event.get()
+        self._pending_events = []
+        if self.smanager.current_stage is not None: events = self.smanager.current_stage.handle_events(events)
         for event in events:
             if event.type == pygame.QUIT: #save settings file and shutdown gracefully
                 self.running = False
             elif event.type == pygame.VIDEORESIZE:
-                self.root.reflow()
+                self._full_reflow = True
                 resize = event.size
+            elif event.type in UIEngine.REPAINT_EVENTS: #only damaged regions get presented, so redraw everything once the window's uncovered
+                self.damage_all()
             elif event.type == pygame.KEYDOWN and self.focused_element:
                 self.focused_element.on_keystroke(event)
                 keystroke = event
@@ -212,44 +364,50 @@ class UIEngine:
                 lmb_up = True
 
         #event handling
-        first_hit = False
-        for element in self.df_traverse(self.root, post=True):
-            if element._rect is None: continue #child hasn't been laid out yet
-            translated_mouse = np.subtract(mouse_pos, element._rect.topleft)
-            #mouse is on child
-            if not first_hit and element._rect.collidepoint(mouse_pos):
-                first_hit = True
-                element.istate.translated_mouse = translated_mouse
-                if not element.istate.is_hovered:
-                    element.on_enter()
-                    element.istate.is_hovered = True
-                element.while_hovered(translated_mouse)
-                if element.istate.is_clicked:
-                    element.while_clicked(translated_mouse)
-                if lmb_down:
-                    element.on_down(translated_mouse)
-                    element.istate.is_clicked = True
-                elif lmb_up and element.istate.is_clicked:
-                    element.on_click(translated_mouse)
-                elif rmb_down:
-                    if element.on_right(): 
-                        self.add({None : ui.stock.ContextMenu(self, element.on_right()).place(ui.pos.Alignment.TOP_LEFT, offset=(mouse_pos))}) #TODO add some logic here to spawn a right mouse handler 
-                elif scroll_up is not None:
-                    element.on_scroll(scroll_up, not scroll_up)
-            #mouse is off child
-            else:
-                element.istate.translated_mouse = None
-                if element.istate.is_hovered:
-                    element.on_exit()
-                    element.istate.is_hovered = False
-                if element.istate.is_kb_focused and not element.istate.keep_kb_focus and lmb_up:
-                    element.istate.is_kb_focused = False
-                    element.on_kb_defocus()
-                    self.focused_element = None
-            #regardless of whether or not its on the child
-            if lmb_up and element.istate.is_clicked: 
+        hit = self.hit_test(mouse_pos)
+        #only the element that lost hover needs to hear about it
+        if self.hovered_element is not None and self.hovered_element is not hit:
+            self.hovered_element.istate.translated_mouse = None
+            self.hovered_element.on_exit()
+            self.hovered_element.istate.is_hovered = False
+            self.hovered_element.activate()
+            self.hovered_element = None
+        #clicking anywhere else drops keyboard focus
+        if lmb_up and self.focused_element is not None and self.focused_element is not hit and not self.focused_element.istate.keep_kb_focus:
+            self.focused_element.istate.is_kb_focused = False
+            self.focused_element.on_kb_defocus()
+            self.focused_element = None
+        #mouse is on element
+        if hit is not None:
+            translated_mouse = np.subtract(mouse_pos, hit._rect.topleft)
+            hit.istate.translated_mouse = translated_mouse
+            if not hit.istate.is_hovered:
+                hit.on_enter()
+                hit.istate.is_hovered = True
+                hit.activate()
+                self.hovered_element = hit
+            hit.while_hovered(translated_mouse)
+            if hit.istate.is_clicked:
+                hit.while_clicked(translated_mouse)
+            if lmb_down:
+                hit.on_down(translated_mouse)
+                hit.istate.is_clicked = True
+                hit.activate()
+                self.clicked_elements.add(hit)
+            elif lmb_up and hit.istate.is_clicked:
+                hit.on_click(translated_mouse)
+            elif rmb_down:
+                if hit.on_right(): 
+                    self.add({None : ui.stock.ContextMenu(self, hit.on_right()).place(ui.pos.Alignment.TOP_LEFT, offset=(mouse_pos))}) #TODO add some logic here to spawn a right mouse handler 
+            elif scroll_up is not None:
+                hit.on_scroll(scroll_up, not scroll_up)
+        #regardless of whether or not the mouse is still on it
+        if lmb_up:
+            for element in self.clicked_elements:
                 element.on_up()
                 element.istate.is_clicked = False
+                element.activate()
+            self.clicked_elements.clear()
 
         if rmb_down: [listener(mouse_pos) for listener in self.event_listeners["rmb_down"]]
         if lmb_up: [listener(mouse_pos) for listener in self.event_listeners["lmb_up"]]
@@ -258,76 +416,208 @@ class UIEngine:
 
     def update(self):
         #how it works
-        #-> traverse all components and update
-        #-> loop over all background threads and check if they're done
-        #-> fire the callback on the main thread with the (err, result) tuple
-
-        if self.smanager.current_stage is not None: self.smanager.current_stage.update(self.clock.get_rawtime())
-        for element in self.df_traverse(self.root):
-            element.update(self.clock.get_rawtime())
+        #-> update only the active elements (animating fades or opted in), dropping the ones that have settled
+        #-> drain the queue of jobs the worker pool has finished
+        #-> fire the callback on the main thread with the (err, result) tuple, unless the job was cancelled
+        #-> step the asyncio loop within the frame's budget, then do the same for any coroutines that finished
+
+        dt = max(0, self.clock.get_time() - self._slept) #real time between frames, minus any time spent asleep
+        if self.smanager.current_stage is not None: self.smanager.current_stage.update(dt)
+        for element in list(self.active):
+            element.update(dt)
+            if not element._keep_active and element.istate.settled():
+                del self.active[element]
         
-        if not self.bg_threads: return
-        for thread in self.bg_threads.copy():
-            if not thread.is_alive():
-                self.bg_threads.remove(thread)
-                if thread.callback is not None:
-                    thread.callback(thread.error, thread.result)
+        while True:
+            try: future = self.workers.completed.get_nowait()
+            except queue.Empty: break
+            callback, _ = self.jobs.pop(future, (None, None))
+            if callback is not None and not future.cancelled():
+                error = future.exception()
+                callback(error, None if error else future.result())
+
+        if self.tasks: self.step_async(self.async_budget)
+        else: self._async_busy = False
+        finished = self._finished_tasks.copy()
+        self._finished_tasks.clear() #cleared in place, every task's done callback holds the list's append
+        for task in finished:
+            callback, _ = self.tasks.pop(task, (None, None))
+            if callback is not None and not task.cancelled():
+                error = task.exception()
+                callback(error, None if error else task.result())
 
     def handle_reflow(self):
         #how it works
-        #-> checks if any ancestor has called reflow()
-        #-> recalculates the entire layout once
-        #-> repositions everything (redundantly in some cases) <- TODO see if becomes an issue
-
-        if self.root._reflow_flag:
+        #-> on the first frame or a window resize, flags every container, drops every memoized size that can depend on the window
+        #   (UIElement.sized_by_window) and lays out the whole tree once
+        #-> otherwise, for every element that called reflow() start at its parent (its placement may have changed)
+        #-> keep climbing while the container's measured size differs from the size it was last laid out at
+        #-> re-distribute the highest container reached within its current rect
+        #-> containers that keep their rect and weren't reflowed skip their subtree, so untouched siblings keep their caches
+
+        if self._full_reflow:
+            self._full_reflow = False
+            self.reflow_queue = dict()
+            self.root._reflow_flag, self.root._measured = True, None
+            containers = [self.root]
+            while containers: #flat walk instead of df_traverse(), this touches every element in the tree
+                container = containers.pop()
+                for element in container._children:
+                    if isinstance(element, ui.base.UIContainer): 
+                        element._reflow_flag = True
+                        containers.append(element)
+                    if element.sized_by_window and element._measured is not None:
+                        element._measured = None
+                        container._strategy.child_reflowed(element)
             self.root.distribute(pygame.Rect((0,0), self.display.size))
-            #print(self.display.size)
+            return
+        if not self.reflow_queue: return
+
+        pending, self.reflow_queue = self.reflow_queue, dict()
+        starts = dict()
+        for element in pending:
+            node = element._parent() if element._parent else element
+            while node._parent and (node._rect is None or pygame.Rect((0,0), node.measured()).size != node._rect.size):
+                node = node._parent()
+            if node is not self.root and not node._parent: continue #not attached to the tree (yet or anymore)
+            starts[node] = None
+        for node in starts: node._reflow_flag = True
+        for node in starts:
+            if not node._reflow_flag: continue #already covered by an ancestor's pass
+            if not node.is_shown(): continue #scrolled out of view, its container lays it out (still flagged) once it's back
+            node.distribute(pygame.Rect((0,0), self.display.size) if node is self.root else node._rect)
 
     def render(self):
         #how it works
-        #-> traverse the entire tree
-        #-> check if element is visible on screen and tell the element to place its surface on the UI display 
-
-        for element in self.df_traverse(self.root):
-            if element._rect.colliderect(self.root._rect):
+        #-> traverse the tree, skipping children their container reports as hidden
+        #-> check if element is visible on screen and tell the element to place its surface on the UI display, clipped to any clipping ancestors
+        #with damage tracking:
+        #-> merge all regions damaged this frame and clear them to the background
+        #-> re-composite only the elements overlapping a damaged region in z-order, clipped to that region
+
+        traversed = 0
+        if not self.damage_tracking:
+            self.damaged = []
+            for element, clip in self.render_traverse(self.root):
+                traversed += 1
+                if element._rect.colliderect(self.root._rect):
+                    self.display.set_clip(clip)
+                    element.render(self.display)
+            self.display.set_clip(None)
+            self.metrics.count("traversed", traversed)
+            return
+        
+        #swapped out before reading, damage() can be called from worker threads and anything added meanwhile lands in one list or the other
+        damaged, self.damaged = self.damaged, []
+        regions = [region for region in ui.util.Graphics.merge_rects(rect.clip(self.root._rect) for rect in damaged) if region]
+        self.presented = regions
+        if not regions: return
+        for region in regions:
+            self.display.fill(Style.COLOURS.BACKGROUND, region)
+        for element, clip in self.render_traverse(self.root):
+            traversed += 1
+            for idx in element._rect.collidelistall(regions):
+                self.display.set_clip(regions[idx] if clip is None else regions[idx].clip(clip))
                 element.render(self.display)
+        self.display.set_clip(None)
+        self.metrics.count("traversed", traversed)
 
     def cleanup(self):
         #how it works
         #-> loop over all elements that have been scheduled for deletion in order of deletion (guaranteed to delete child before parent and not vice versa)
-        #-> defocus if necessary
         #-> traverse all of its kids recursively
-        #-> for every ancestor, remove from global tracker, call cleanup, delete parent reference to child, delete child reference to parent
+        #-> for every ancestor, drop any focus/hover/click/update state, remove from spatial index + global tracker, recycle its id, call cleanup and drop its reference to its parent
+        #-> only the deleted element itself is unlinked from its parent's children, everything under it goes with it
         #-> maintain a set of living parents of dead children and call reflow() on those 
 
         parents = set()
         for el in self.detracker.copy():
-            if self.focused_element and el == self.focused_element: 
-                self.focused_element = None
             self.detracker.pop(el)
             for kid in self.df_traverse(el, post=True): #traverse will also return el itself 
+                if kid is self.focused_element: self.focused_element = None
+                if kid is self.hovered_element: self.hovered_element = None
+                self.clicked_elements.discard(kid)
+                self.active.pop(kid, None)
+                self.spatial.remove(kid)
                 self.tracker.remove(kid)
+                self.ids.release(kid._id)
+                self.damage(kid._rect)
                 kid.cleanup()
                 parents.discard(kid)
-                parents.add(kid._parent())
-                kid._parent()._elements.inverse.pop(kid)
-                kid._parent = None
+                if kid is el:
+                    parents.add(kid._parent())
+                    kid._parent()._remove_child(kid)
+                else: kid._parent = None #its parent is going too, no point unlinking it from its siblings
         for parent in parents:
             parent.reflow()
             
     def tick(self):
-        self.display.fill(Style.COLOURS.BACKGROUND)
-        times = []
+        frame_start = time.perf_counter()
+        if not self.damage_tracking: self.display.fill(Style.COLOURS.BACKGROUND)
+        if self.overlay: [self.damage(rect) for rect in self.overlay.refresh(self.display.height)]
         for phase in (self.handle_events, self.update, self.handle_reflow, self.render, self.cleanup):
             start = time.perf_counter()
             phase()
-            times.append(time.perf_counter() - start)
-        for i, tt in enumerate(times):
-            taken = self.fonts[16].render(f"{round(tt * 1000, 2)} ms", 1, [255]*3) 
-            self.display.blit(taken, (0, self.display.height-taken.height*(i+1)))
-        pygame.display.flip() #actually shows any changes to the display 
-
-    def loop(self, fps):
-        while self.running:
-            self.tick()
-            self.clock.tick(fps)
\ No newline at end of file
+            self.phase_times[phase.__name__] = (time.perf_counter() - start) * 1000
+        #the overlay sits on top of the ui, so it's redrawn wherever the ui under it was
+        if self.overlay and (not self.damage_tracking or any(rect.collidelist(self.presented) != -1 for rect in self.overlay.rects)):
+            self.overlay.draw(self.display)
+        if self.damage_tracking: #only push the regions that were recomposited this frame
+            pygame.display.update(self.presented)
+            self.presented = []
+        else: pygame.display.flip() #actually shows any changes to the display 
+        self.metrics.end_frame(self.phase_times, (time.perf_counter() - frame_start) * 1000)
+
+    def is_idle(self):
+        """true when the next frame would have nothing to do: 
+        nothing damaged, no pending reflow/deletion, no active elements and no finished jobs or coroutines waiting on a callback
+        \n stages that animate in Stage.update() should keep an element active (UIElement.activate(persistent=True))"""
+        return not (self.damaged or self.reflow_queue or self._full_reflow or self.active or self.detracker or self._pending_events
+                    or not self.workers.completed.empty() or self._finished_tasks or self._async_busy)
+
+    def wake(self):
+        """interrupts an idle sleep, safe to call from any thread"""
+        if self._sleeping: pygame.event.post(pygame.Event(UIEngine.WAKE_EVENT))
+
+    def sleep(self, timeout):
+        """blocks until any event arrives or timeout (ms) passes, returns how many ms were spent asleep"""
+        start = time.perf_counter()
+        event = self._async_wait(timeout) if self.tasks else pygame.event.wait(timeout)
+        if event.type not in (pygame.NOEVENT, UIEngine.WAKE_EVENT): self._pending_events.append(event)
+        slept = time.perf_counter() - start
+        self.idle_time += slept
+        return slept * 1000
+
+    def _async_wait(self, timeout) -> pygame.Event:
+        """pygame.event.wait() that keeps the asyncio loop going, so coroutines waiting on io make progress while idle
+        \n waits on io in ASYNC_SLICE ms slices, checking for input in between"""
+        deadline = time.perf_counter() + timeout / 1000
+        while time.perf_counter() < deadline:
+            self.aloop.call_later(UIEngine.ASYNC_SLICE / 1000, self.aloop.stop)
+            self.aloop.run_forever()
+            event = pygame.event.poll()
+            if event.type != pygame.NOEVENT: return event
+            if not self.is_idle(): break #a coroutine finished or damaged something
+        return pygame.Event(pygame.NOEVENT)
+
+    def loop(self, fps, idle=False, idle_timeout=1000):
+        """ticks the engine at fps until the window is closed
+        \n with idle=True, frames where nothing would change are skipped by sleeping until input arrives, 
+        a job finishes, something is marked dirty from another thread or idle_timeout (ms) passes"""
+        self.metrics.target_fps = fps
+        try:
+            while self.running:
+                self.tick()
+                if not self.running: break #closed this frame, don't idle before noticing
+                self._sleeping = True #set before checking so a wake() racing the check still interrupts the sleep
+                self._slept = self.sleep(idle_timeout) if idle and self.is_idle() else 0
+                self._sleeping = False
+                self.clock.tick(fps)
+        finally: self.close()
+
+    def close(self):
+        """shuts down both job pools, cancelling every job that hasn't started. callbacks of jobs still running never fire
+        \n called when loop() exits, call it yourself if you tick the engine by hand. safe to call more than once"""
+        self.workers.shutdown()
+        self.processes.shutdown()
+        self.jobs.clear()
\ No newline at end of file
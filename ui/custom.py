@@ -1,4 +1,7 @@
+import hashlib
+import os
 import pathlib
+import tempfile
 
 import pydub
 import pydub.playback
@@ -11,64 +14,258 @@ import ui.pos
 from ui.style import Style
 import ui.util
 
+def decode(path : str) -> np.ndarray:
+    """decodes an audio file to 44.1khz stereo pcm, an int16 (frames, 2) array
+    \n module level so Waveform can run it in a worker process"""
+    path = pathlib.Path(path)
+    audio_seg = pydub.AudioSegment.from_file(path, path.suffix[1:]).set_frame_rate(44100).set_sample_width(2).set_channels(2)
+    return np.frombuffer(audio_seg.raw_data, np.int16).reshape((-1, 2))
+
+class Peaks:
+    """min/max pyramid of a track, so drawing it at any width only touches about that many values
+    \n level 0 has the min and max of every BASE frames for both channels, each level above halves the one below it until there's one entry left.
+    the whole pyramid is one int16 (rows, channel, min/max) array saved next to the track as a .npy and memory mapped back,
+    with the first HEADER rows holding (BASE, file size, file mtime, frames) as int64s so a stale cache is noticed and rebuilt"""
+    BASE = 256
+    HEADER = 4 #each row is 4 int16s, one int64
+
+    def cache_path(path : pathlib.Path) -> pathlib.Path:
+        """the sidecar next to the track, or a file in the temp dir when the track's folder isn't writable"""
+        path = pathlib.Path(path).resolve()
+        if os.access(path.parent, os.W_OK): return path.with_name(path.name + ".peaks.npy")
+        return pathlib.Path(tempfile.gettempdir(), "peaks", hashlib.sha1(str(path).encode()).hexdigest() + ".npy")
+
+    def key(path : pathlib.Path) -> tuple[int, int, int]:
+        stat = os.stat(path)
+        return (Peaks.BASE, stat.st_size, stat.st_mtime_ns)
+
+    def levels(frames : int) -> list[tuple[int, int]]:
+        """(first row, length) of every level, finest first"""
+        levels, row, length = [], Peaks.HEADER, max(1, -(-frames // Peaks.BASE))
+        while True:
+            levels.append((row, length))
+            if length == 1: return levels
+            row += length
+            length = -(-length // 2)
+
+    def open(path : pathlib.Path) -> np.ndarray:
+        """the memory mapped pyramid for the track, None if it hasn't been built or the track changed since"""
+        try: peaks = np.load(Peaks.cache_path(path), mmap_mode="r")
+        except (OSError, ValueError): return None
+        if peaks.ndim != 3 or len(peaks) < Peaks.HEADER: return None
+        if tuple(Peaks.header(peaks)[:3]) != Peaks.key(path): return None
+        return peaks
+
+    def header(peaks : np.ndarray) -> np.ndarray:
+        return peaks[:Peaks.HEADER].reshape((Peaks.HEADER, 4)).view(np.int64)[:, 0]
+
+    def build(path : str):
+        """decodes the track and writes its pyramid to the cache, run in a worker process by Waveform"""
+        key = Peaks.key(path) #before decoding, so a track modified meanwhile is seen as stale next time
+        pcm = decode(path)
+        levels = Peaks.levels(len(pcm))
+        cache = Peaks.cache_path(path)
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        temp = cache.with_name(f"{cache.name}.{os.getpid()}.tmp")
+        peaks = np.lib.format.open_memmap(temp, mode="w+", dtype=np.int16, shape=(levels[-1][0] + 1, 2, 2))
+        Peaks.header(peaks)[:] = (*key, len(pcm))
+
+        row, length = levels[0]
+        whole = len(pcm) // Peaks.BASE
+        blocks = pcm[:whole * Peaks.BASE].reshape((whole, Peaks.BASE, 2))
+        peaks[row:row + whole, :, 0] = blocks.min(axis=1)
+        peaks[row:row + whole, :, 1] = blocks.max(axis=1)
+        if whole < length: #the leftover frames, or silence for an empty track
+            rest = pcm[whole * Peaks.BASE:] if len(pcm) else np.zeros((1, 2), np.int16)
+            peaks[row + whole, :, 0], peaks[row + whole, :, 1] = rest.min(axis=0), rest.max(axis=0)
+        for (below, below_length), (row, length) in zip(levels, levels[1:]):
+            pairs = below_length // 2
+            level = peaks[below:below + pairs * 2].reshape((pairs, 2, 2, 2))
+            peaks[row:row + pairs, :, 0] = level[:, :, :, 0].min(axis=1)
+            peaks[row:row + pairs, :, 1] = level[:, :, :, 1].max(axis=1)
+            if pairs < length: peaks[row + pairs] = peaks[below + below_length - 1]
+        peaks.flush()
+        del peaks
+        os.replace(temp, cache)
+
+    def columns(peaks : np.ndarray, width : int, channel=0) -> tuple[np.ndarray, np.ndarray]:
+        """the min and max of each of width columns spanning the track, read from the coarsest level with at least width entries"""
+        levels = Peaks.levels(int(Peaks.header(peaks)[3]))
+        row, length = next((level for level in reversed(levels) if level[1] >= width), levels[0])
+        level = peaks[row:row + length, channel]
+        starts = np.arange(width) * length // width
+        return np.minimum.reduceat(level[:, 0], starts), np.maximum.reduceat(level[:, 1], starts)
+
 class Waveform(ui.base.UIElement):
-    """generates a waveform that can be clicked on to play 10 seconds starting from click position"""
-    def __init__(self, ui_instance, size, path, **kwargs):
+    """generates a waveform that can be clicked on to play 10 seconds starting from click position
+    \n drawn from a Peaks pyramid, built in a worker process the first time a track's opened (until then the element just says it's loading)
+    \n a track that can't be opened or decoded doesn't raise, the error's kept in `error`, printed and shown in place of the graph's label
+    \n the pcm to play is only decoded on the first click, also in a worker process, and kept as one contiguous int16 array.
+    playing streams it through the channel's queue CHUNK frames at a time, so a click only ever copies a chunk of it into a Sound
+    \n antialias smooths the graph's edges, stereo draws the right channel translucently over the left one
+    \n the graph's the cached surface, the hover cursor and timecode are an overlay so moving the mouse never redraws it"""
+    __slots__ = ("path", "antialias", "stereo", "peaks", "pcm", "relative", "loading", "error", "graph", "channel", 
+                 "_decoding", "_play_from", "_stream", "_cursor")
+    RATE = 44100
+    RIGHT_ALPHA = 160
+    PLAY_FOR = 10 * RATE #frames played per click
+    CHUNK = 8192 #frames per queued Sound, ~190ms so a slow frame or two can't starve the queue
+
+    def __init__(self, ui_instance, size, path, antialias=False, stereo=False, **kwargs):
         super().__init__(ui_instance, **kwargs)
         self.path = pathlib.Path(path)
-        self.audio_seg : pydub.AudioSegment = pydub.AudioSegment.from_file(self.path, self.path.suffix[1:]).set_frame_rate(44100).set_sample_width(2).set_channels(2)
+        self.antialias = antialias
+        self.stereo = stereo
+        self.peaks : np.ndarray = Peaks.open(self.path)
+        self.pcm : np.ndarray = None #(frames, 2) int16
         self.relative = np.divide(size, self._uii.display.size)    
-        self.loading = False
+        self.loading = self.peaks is None
+        self.error : ui.util.Exceptions.UIMediaException = None
+        self._decoding = False
+        self._play_from : int = None #frame to start playing from once the pcm's decoded, if the click's still held
+        self._stream : list[int] = None #[next frame to queue, frame to stop at] while playing
+        self._cursor : int = None #x of the hover cursor, relative to the element
 
         self.graph : pygame.Surface = None
         self.channel : pygame.mixer.Channel = None
         self._uii.add_event_listener("resize", self.resize)
         self.resize(self._uii.display.size)
+        if self.loading: self._uii.start_job(Peaks.build, self.built, (str(self.path),), group=self, process=True)
+
+    @property
+    def frames(self) -> int:
+        return int(Peaks.header(self.peaks)[3])
+
+    @property
+    def duration(self) -> float:
+        """in seconds"""
+        return self.frames / Waveform.RATE
+
+    def built(self, err, _):
+        if err is not None: return self.failed(f"Can't open {self.path}", err)
+        self.peaks = Peaks.open(self.path)
+        if self.peaks is None: return self.failed(f"{self.path} changed while it was being opened")
+        self.loading = False
+        self.resize(self._uii.display.size)
+        self.mark_dirty()
+
+    def decoded(self, err, pcm):
+        self._decoding = False
+        if err is not None: return self.failed(f"Can't decode {self.path}", err)
+        self.pcm = pcm
+        if self._play_from is not None: self.play(self._play_from)
+
+    def failed(self, message : str, cause : Exception = None):
+        """job callbacks run inside the engine's update(), so a bad track is shown on the element instead of raised"""
+        self.error = ui.util.Exceptions.UIMediaException(message)
+        self.error.__cause__ = cause
+        print(f"{message}: {cause!r}" if cause is not None else message)
+        self._play_from = None
+        self.mark_dirty()
         
     def resize(self, screen_size):
         self.graph = pygame.Surface((np.multiply(screen_size, self.relative)), pygame.SRCALPHA)
-        samp_array = np.array(self.audio_seg.split_to_mono()[0].get_array_of_samples()[::10]).astype(np.float64)
-        samp_array /= np.max(np.abs(samp_array))
-        samples_per_line = int(len(samp_array) // self.graph.width)
-        bins = samp_array[:self.graph.width*samples_per_line].reshape((self.graph.width, samples_per_line))
-        mins, maxs = bins.min(axis=1), bins.max(axis=1)
+        if self.loading: return
+        channels = (0, 1) if self.stereo else (0,)
+        top = Peaks.levels(self.frames)[-1][0]
+        scale = max(1, np.abs(self.peaks[top, channels].astype(np.int32)).max()) #normalised to the loudest sample
 
         mid = self.graph.height // 2
-        for x in range(self.graph.width):
-            y_min = int(mid - maxs[x] * mid)
-            y_max = int(mid - mins[x] * mid)
-            pygame.draw.line(self.graph, Style.COLOURS.TEXT_NORMAL, (x, y_min), (x, y_max))
+        for channel, colour in zip(channels, (Style.COLOURS.TEXT_NORMAL, Style.COLOURS.TEXT_HIGHLIGHTED)):
+            mins, maxs = Peaks.columns(self.peaks, self.graph.width, channel)
+            tops, bottoms = mid - maxs / scale * mid, mid - mins / scale * mid
+            if self.antialias: bottoms = np.maximum(bottoms, tops + 1) #at least a pixel's worth, even for silence
+            else: tops, bottoms = tops.astype(int), bottoms.astype(int) + 1
+            if channel == 0: ui.util.Graphics.draw_columns(self.graph, tops, bottoms, colour)
+            else: #drawn on its own layer and blitted translucently, pygame blends it much faster than numpy could
+                layer = pygame.Surface(self.graph.size, pygame.SRCALPHA)
+                ui.util.Graphics.draw_columns(layer, tops, bottoms, colour)
+                layer.set_alpha(Waveform.RIGHT_ALPHA)
+                self.graph.blit(layer, (0, 0))
 
     def measure(self):
         return np.multiply(self.relative, self._uii.display.size)
     
     def draw_surf(self):
+        if not self.loading and self.error is None: return self.graph
         res = self.graph.copy()
-        if self.istate.translated_mouse is not None:
-            pos = int(self.istate.translated_mouse[0]/res.width * self.audio_seg.duration_seconds)
-            if pos > 60: tc = f"{pos//60}:{pos%60:02d}"
-            else: tc = str(pos)
-            pygame.draw.line(res, Style.COLOURS.FOREGROUND_DEEMPHASISED, 
-                             (self.istate.translated_mouse[0], 0),
-                             (self.istate.translated_mouse[0], res.height))
-            res.blit(self._uii.fonts[Style.SIZES.FONT_MED].render(tc, 1, Style.COLOURS.TEXT_HIGHLIGHTED, Style.COLOURS.FOREGROUND_DEEMPHASISED), (0,0))
+        label = "Loading..." if self.error is None else str(self.error)
+        t = self._uii.fonts[Style.SIZES.FONT_MED].render(label, True, Style.COLOURS.TEXT_NORMAL)
+        res.blit(t, (res.width/2 - t.width/2, res.height/2 - t.height/2))
         return res
+
+    def timecode(self, x) -> pygame.Surface:
+        pos = int(x/self.graph.width * self.duration)
+        if pos > 60: tc = f"{pos//60}:{pos%60:02d}"
+        else: tc = str(pos)
+        return self._uii.fonts[Style.SIZES.FONT_MED].render(tc, 1, Style.COLOURS.TEXT_HIGHLIGHTED, Style.COLOURS.FOREGROUND_DEEMPHASISED)
+
+    def draw_overlay(self, surface):
+        if self.loading or self._cursor is None: return
+        x = self._rect.left + self._cursor
+        pygame.draw.line(surface, Style.COLOURS.FOREGROUND_DEEMPHASISED, (x, self._rect.top), (x, self._rect.bottom))
+        surface.blit(self.timecode(self._cursor), self._rect.topleft)
+
+    def move_cursor(self, x : int):
+        """moves the hover cursor, None hides it, only recompositing where it was and where it's going"""
+        if x == self._cursor: return
+        for cursor in (self._cursor, x):
+            if cursor is None or self.loading: continue
+            self.mark_overlay_dirty((cursor, 0, 1, self._rect.height))
+            self.mark_overlay_dirty(self.timecode(cursor).get_rect())
+        self._cursor = x
     
+    def play(self, start : int):
+        """starts playing from frame start, the rest is queued from update()"""
+        self.stop()
+        self._stream = [start, min(start + Waveform.PLAY_FOR, len(self.pcm))]
+        self.channel = self.next_chunk().play()
+        if self.channel is None: self._stream = None #no free channels
+        else: self.activate(persistent=True)
+
+    def next_chunk(self) -> pygame.mixer.Sound:
+        start, end = self._stream
+        self._stream[0] = min(start + Waveform.CHUNK, end)
+        return pygame.mixer.Sound(buffer=self.pcm[start:self._stream[0]]) #a view of the pcm, the only copy is the Sound's own
+
+    def stop(self):
+        self._stream = None
+        if self.channel is not None:
+            self.channel.stop()
+            self.channel.stop() #the first only starts whatever chunk was queued
+        self.deactivate()
+
+    def update(self, dt):
+        super().update(dt)
+        if self._stream is None: return
+        if self._stream[0] < self._stream[1]:
+            if self.channel.get_queue() is None: self.channel.queue(self.next_chunk())
+        elif not self.channel.get_busy(): self.stop()
+
     def while_hovered(self, translated_mouse):
-        self.mark_dirty()
+        self.move_cursor(int(translated_mouse[0]))
     def on_exit(self):
-        self.mark_dirty()
+        self.move_cursor(None)
     def on_down(self, translated_mouse):
-        prog = (translated_mouse[0] / self.graph.width)*self.audio_seg.duration_seconds*1000
-        self.channel = pygame.mixer.Sound(np.array(self.audio_seg[prog:prog+10000].get_array_of_samples())).play()
+        if self.loading or self.error is not None: return
+        start = int(translated_mouse[0] / self.graph.width * self.frames)
+        if self.pcm is not None: return self.play(start)
+        if not self._decoding: self._uii.start_job(decode, self.decoded, (str(self.path),), group=self, process=True)
+        self._decoding = True
+        self._play_from = start
     def on_up(self):
-        self.channel.stop()
+        self._play_from = None
+        self.stop()
 
     def cleanup(self):
         self._uii.remove_event_listener("resize", self.resize)
+        self._uii.cancel_jobs(self)
+        self.stop()
 
 class Scrubber(ui.base.UIElement):
     """generates a scrubber with n nodes to scrub from 0 to total"""
+    __slots__ = ("rel_width", "total", "nodes")
+
     def __init__(self, ui_instance, width, total, nodes, **kwargs):
         super().__init__(ui_instance, **kwargs)
         self.rel_width = width / self._uii.display.width
@@ -82,23 +279,28 @@ class Scrubber(ui.base.UIElement):
     def draw_surf(self):
         res = pygame.Surface(self.measure(), pygame.SRCALPHA)
         #bg
-        res.blit(ui.util.Graphics.coloured_square(Style.COLOURS.FOREGROUND, res.size, Style.ALPHA.LAYOUT), (0,0))
+        res.blit(ui.util.Graphics.coloured_square(Style.COLOURS.FOREGROUND, res.size, Style.ALPHA.LAYOUT, copy=False), (0,0))
         #line
         p_total = Style.PADDING.BUTTON_PADDING + Style.PADDING.LAYOUT_PADDING
         l_width = res.width - p_total * 2
         pygame.draw.line(res, Style.COLOURS.FOREGROUND, 
                          (p_total, res.height/2),
                          (p_total + l_width, res.height/2))
-        #nodes
+        return res
+
+    def draw_overlay(self, surface):
+        #nodes, drawn over the cached background and line so dragging one doesn't redraw the rest
+        p_total = Style.PADDING.BUTTON_PADDING + Style.PADDING.LAYOUT_PADDING
+        l_width = self._rect.width - p_total * 2
         for pos in self.nodes:
             pos = int(pos)
             if pos > 60: tc = f"{pos//60}:{pos%60:02d}"
             else: tc = str(pos)
             n_t = self._uii.fonts[Style.SIZES.FONT_MED].render(tc, 1, Style.COLOURS.TEXT_HIGHLIGHTED)
-            bg = ui.util.Graphics.coloured_square(Style.COLOURS.FOREGROUND, np.add(n_t.size, [Style.PADDING.BUTTON_PADDING*2]*2), Style.ALPHA.BUTTON_ACTIVE)
-            bg.blit(n_t, [Style.PADDING.BUTTON_PADDING]*2)
-            res.blit(bg, ((p_total+(pos/self.total)*l_width) - bg.width/2, res.height/2 - bg.height/2))
-        return res
+            bg = ui.util.Graphics.coloured_square(Style.COLOURS.FOREGROUND, np.add(n_t.size, [Style.PADDING.BUTTON_PADDING*2]*2), Style.ALPHA.BUTTON_ACTIVE, copy=False)
+            x, y = self._rect.left + p_total + (pos/self.total)*l_width - bg.width/2, self._rect.top + self._rect.height/2 - bg.height/2
+            surface.blit(bg, (x, y))
+            surface.blit(n_t, (x + Style.PADDING.BUTTON_PADDING, y + Style.PADDING.BUTTON_PADDING))
     
     def while_clicked(self, translated_mouse):
         pixel_positions = [ts/self.total * self._rect.width for ts in self.nodes]
@@ -107,4 +309,4 @@ class Scrubber(ui.base.UIElement):
         prev = self.nodes[closest_idx - 1] if closest_idx > 0 else 0
         next_ = self.nodes[closest_idx + 1] if closest_idx < len(self.nodes) - 1 else self.total
         self.nodes[closest_idx] = max(min(int(new_timestamp), next_ - 1), prev + 1)
-        self.mark_dirty()
\ No newline at end of file
+        self.mark_overlay_dirty()
\ No newline at end of file
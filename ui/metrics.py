@@ -0,0 +1,138 @@
+import csv
+import json
+import time
+
+import numpy as np
+import pygame
+
+class Ring:
+    """fixed size buffer holding the latest samples of something measured once a frame"""
+    def __init__(self, size : int):
+        self.samples = np.zeros(size)
+        self.count = 0 #samples ever pushed, not just the ones still held
+
+    def __len__(self):
+        return min(self.count, len(self.samples))
+
+    def push(self, value : float):
+        self.samples[self.count % len(self.samples)] = value
+        self.count += 1
+
+    def values(self) -> np.ndarray:
+        """held samples, oldest first"""
+        if self.count <= len(self.samples): return self.samples[:self.count]
+        start = self.count % len(self.samples)
+        return np.concatenate((self.samples[start:], self.samples[:start]))
+
+    def last(self) -> float:
+        return float(self.samples[(self.count - 1) % len(self.samples)]) if self.count else 0.0
+
+    def stats(self) -> dict[str, float]:
+        """p50, p95, p99, max and mean of the held samples"""
+        values = self.values()
+        if not len(values): return dict.fromkeys(("p50", "p95", "p99", "max", "mean"), 0.0)
+        p50, p95, p99 = np.percentile(values, (50, 95, 99))
+        return {"p50" : float(p50), "p95" : float(p95), "p99" : float(p99), "max" : float(values.max()), "mean" : float(values.mean())}
+
+class Metrics:
+    """rolling per-frame timings and counters for the last `size` frames, see UIEngine.metrics
+    \n phases are timed by UIEngine.tick(), elements add to the counters with count() as they work
+    \n caches with hits/misses totals (like ui.util.Caches.LRU) can be watched to get their per-frame hits and misses"""
+    PHASES = ("handle_events", "update", "handle_reflow", "render", "cleanup")
+    COUNTERS = ("traversed", "redrawn") #elements visited by render, surfaces redrawn by draw_surf
+
+    def __init__(self, size=600, target_fps=60):
+        self.size = size
+        self.target_fps = target_fps #frames taking longer than 1/target_fps count as dropped, None to not count
+        self.frames = 0
+        self.dropped = 0
+        self.frame_ms = Ring(size)
+        self.phase_ms = {phase : Ring(size) for phase in Metrics.PHASES}
+        self.counters = {name : Ring(size) for name in Metrics.COUNTERS}
+        self._counting = dict.fromkeys(Metrics.COUNTERS, 0) #this frame's tally so far
+        self._caches = {} #name -> [cache, hits, misses] totals as of the last frame
+
+    def count(self, counter : str, n=1):
+        """adds n to the counter for the current frame"""
+        self._counting[counter] += n
+
+    def watch_cache(self, name : str, cache):
+        """samples cache.hits and cache.misses every frame into the {name}_hits and {name}_misses counters"""
+        self._caches[name] = [cache, cache.hits, cache.misses]
+        self.counters[f"{name}_hits"] = Ring(self.size)
+        self.counters[f"{name}_misses"] = Ring(self.size)
+
+    def end_frame(self, phase_times : dict[str, float], frame_ms : float):
+        """called by UIEngine.tick() once a frame's done, with how long each phase and the whole frame took in ms"""
+        self.frames += 1
+        if self.target_fps and frame_ms > 1000 / self.target_fps: self.dropped += 1
+        self.frame_ms.push(frame_ms)
+        for phase, ring in self.phase_ms.items(): ring.push(phase_times.get(phase, 0.0))
+        for name, tally in self._counting.items():
+            self.counters[name].push(tally)
+            self._counting[name] = 0
+        for name, entry in self._caches.items():
+            cache, hits, misses = entry
+            self.counters[f"{name}_hits"].push(cache.hits - hits)
+            self.counters[f"{name}_misses"].push(cache.misses - misses)
+            entry[1], entry[2] = cache.hits, cache.misses
+
+    def summary(self) -> dict:
+        """everything, as plain numbers"""
+        return {"frames" : self.frames, "dropped" : self.dropped, "target_fps" : self.target_fps,
+                "frame_ms" : self.frame_ms.stats(),
+                "phase_ms" : {phase : ring.stats() for phase, ring in self.phase_ms.items()},
+                "counters" : {name : ring.stats() for name, ring in self.counters.items()}}
+
+    def to_json(self, path : str):
+        with open(path, "w") as f: json.dump(self.summary(), f, indent=2)
+
+    def to_csv(self, path : str):
+        """one row per held frame, oldest first"""
+        columns = {"frame_ms" : self.frame_ms, **self.phase_ms, **self.counters}
+        rows = min(len(ring) for ring in columns.values())
+        values = [ring.values()[len(ring) - rows:] for ring in columns.values()]
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame", *columns])
+            for i in range(rows):
+                writer.writerow([self.frames - rows + i, *(round(float(column[i]), 4) for column in values)])
+
+class Overlay:
+    """rolling timings drawn in the bottom left corner of the display, turned on with UIEngine(overlay=True)
+    \n the text is refreshed at most every interval ms and only lines whose text changed get re-rasterised"""
+    def __init__(self, metrics : Metrics, font, interval=250):
+        self.metrics = metrics
+        self.font = font
+        self.interval = interval
+        self.lines : list[str] = []
+        self.surfaces : list[pygame.Surface] = []
+        self.rects : list[pygame.Rect] = []
+        self._refreshed = 0.0
+
+    def text(self) -> list[str]:
+        lines = [f"{phase} {ring.stats()['p50']:.2f} ms" for phase, ring in self.metrics.phase_ms.items()]
+        lines.append(f"frame p95 {self.metrics.frame_ms.stats()['p95']:.2f} ms, {self.metrics.dropped} dropped")
+        return lines
+
+    def refresh(self, display_height : int) -> list[pygame.Rect]:
+        """re-renders any changed lines if a refresh is due, returns the screen regions that need recompositing because of it"""
+        now = time.perf_counter()
+        if (now - self._refreshed) * 1000 < self.interval: return []
+        self._refreshed = now
+        lines = self.text()
+        bottom = self.rects[-1].bottom if self.rects else None
+        if lines == self.lines and bottom == display_height: return []
+        stale = self.rects
+        self.surfaces = [surface if i < len(self.lines) and self.lines[i] == line else self.font.render(line, True, (255, 255, 255))
+                         for i, (line, surface) in enumerate(zip(lines, self.surfaces + [None] * len(lines)))]
+        self.lines = lines
+        y = display_height - sum(surface.get_height() for surface in self.surfaces)
+        self.rects = []
+        for surface in self.surfaces:
+            self.rects.append(surface.get_rect(topleft=(0, y)))
+            y += surface.get_height()
+        return stale + self.rects
+
+    def draw(self, surface : pygame.Surface):
+        for line, rect in zip(self.surfaces, self.rects): surface.blit(line, rect)
@@ -1,11 +1,14 @@
+from bisect import bisect_right
 from enum import Enum
-from typing import Literal, TYPE_CHECKING
+from itertools import chain
+from typing import Callable, Literal, TYPE_CHECKING
 
 import numpy as np
 import pygame
 
 from ui.style import Style
 import ui.base
+import ui.util
 
 if TYPE_CHECKING:
     import ui.core
@@ -25,10 +28,14 @@ def virtualise_coords(uii, coords):
     return np.multiply(np.divide(coords, Style.SIZES.BASE_RES), uii.display.size)
 
 class Position:
+    __slots__ = ("align", "anchor", "offset", "factors")
+
     def __init__(self, anchor=Alignment.CENTRE, align=None, offset=(0, 0)):
         self.align = align if align is not None else anchor
         self.anchor = anchor
         self.offset = offset
+        #(anchor x, anchor y, align x, align y, offset x, offset y), for layouts that resolve many kids at once
+        self.factors = (*self.anchor.value, *self.align.value, *offset)
 
     def resolve(self, child_size, parent_size):
         #not exhaustively tested
@@ -43,10 +50,21 @@ class Position:
         return final_x, final_y
     
 class Strategy:
+    indexes_children = False #if true, kids stay out of the engine's spatial grid and hit tests ask child_at() instead
+
     def measure(self, children: list['ui.base.UIElement']) -> pygame.Rect:
         raise NotImplementedError
     def distribute(self, children: list['ui.base.UIElement'], bounds: pygame.Rect) -> None:
         raise NotImplementedError
+    def child_at(self, children: list['ui.base.UIElement'], point) -> 'ui.base.UIElement':
+        """the kid whose cell contains point as of the last distribute, only needed if indexes_children"""
+        raise NotImplementedError
+    def invalidate(self) -> None:
+        """called by the container whenever a kid is added or removed, for strategies that cache anything per kid"""
+        pass
+    def child_reflowed(self, child : 'ui.base.UIElement') -> None:
+        """called from child.reflow() when the kid's size or placement may have changed, for strategies that cache anything per kid"""
+        pass
     
 class BoxLayout(Strategy):
     """lays out kids one by one either horizontally or vertically"""
@@ -56,7 +74,7 @@ class BoxLayout(Strategy):
     def measure(self, children):
         main_total = cross_max = 0
         for child in children:
-            c_w, c_h = child.measure() 
+            c_w, c_h = child.measured() 
             main_total += c_h if self.alignment == "vertical" else c_w
             cross_max = max(c_w if self.alignment == "vertical" else c_h, cross_max) 
             
@@ -71,7 +89,7 @@ class BoxLayout(Strategy):
         tl = bounds.topleft
         main_total = Style.PADDING.LAYOUT_PADDING
         for child in children:
-            c_w, c_h = child.measure()
+            c_w, c_h = child.measured()
             #calculate where to shift the top left of the kid to take into account position in the layout + padding
             c_offset = (Style.PADDING.LAYOUT_PADDING, main_total) if self.alignment == "vertical" else (main_total, Style.PADDING.LAYOUT_PADDING)
             #calculate the space to give the kid to align itself in
@@ -88,12 +106,268 @@ class StackLayout(Strategy):
     def measure(self, children):
         if not children: return (0, 0)
         for child in children:
-            return child.measure()
+            return child.measured()
             
     def distribute(self, children, bounds):
         tl = bounds.topleft
         size = bounds.size
         for child in children:
-            c_size = child.measure()
+            c_size = child.measured()
             c_tl = np.add(tl, child._pos.resolve(c_size, size))
-            child.distribute(pygame.Rect(c_tl, c_size))
\ No newline at end of file
+            child.distribute(pygame.Rect(c_tl, c_size))
+
+
+class GridLayout(Strategy):
+    """lays kids out row by row in a rows x cols table, every column as wide as its widest kid and every row as tall as its tallest
+    \n the whole table is solved in one numpy pass, kids then align themselves in their cell like in a StackLayout
+    \n the kids are indexed by cell, so hit testing bisects the column/row edges instead of putting every kid in the spatial grid
+    \n every kid's size and Position.factors are kept in one array between layouts, only the rows of kids that reflowed get re-read
+    and a relayout where none did and the bounds haven't moved does nothing. leaf kids that only moved are placed in bulk"""
+    indexes_children = True
+
+    def __init__(self, rows : int, cols : int):
+        self.rows = rows
+        self.cols = cols
+        #cell edges in screen space from the last distribute
+        self.col_left : list[int] = []
+        self.col_right : list[int] = []
+        self.row_top : list[int] = []
+        self.row_bottom : list[int] = []
+        self._kids : np.ndarray = None #(n, 8) of w, h, Position.factors per kid, None when it needs rebuilding
+        self._index : dict['ui.base.UIElement', int] = {} #kid -> its row in _kids
+        self._plain = np.zeros(0, bool) #kids that don't override UIElement.distribute(), placed in bulk
+        self._dirty : set['ui.base.UIElement'] = set() #kids that reflowed since their row was last read
+        self._stale = True #_kids changed since the last distribute
+        #where everything went last distribute, so kids that didn't move can be skipped
+        self._bounds : pygame.Rect = None
+        self._rects = np.zeros((0, 4))
+
+    def _table(self, sizes : np.ndarray):
+        """column widths and row heights for an (n, 2) array of kid sizes"""
+        if len(sizes) > self.rows * self.cols: 
+            raise ui.util.Exceptions.UILayoutException(f"{len(sizes)} elements don't fit in a {self.rows}x{self.cols} grid!")
+        table = np.zeros((self.rows * self.cols, 2), dtype=np.int64)
+        table[:len(sizes)] = sizes
+        table = table.reshape(self.rows, self.cols, 2)
+        return table[:, :, 0].max(axis=0), table[:, :, 1].max(axis=1)
+
+    def invalidate(self):
+        self._kids = None
+        self._dirty.clear()
+
+    def child_reflowed(self, child):
+        self._dirty.add(child)
+
+    def _gather(self, children) -> np.ndarray:
+        return np.fromiter(chain.from_iterable((*child.measured(), *child._pos.factors) for child in children), 
+                           np.float64, count=8*len(children)).reshape(-1, 8)
+
+    def _refresh(self, children):
+        """re-reads the kids that reflowed since the last call into _kids, or all of them after invalidate()
+        \n reflow() (and place(), mark_dirty(resize=True)) reports the kid through child_reflowed(), 
+        its memoized size can't be used for this as the engine re-measures ancestors before laying them out"""
+        if self._kids is not None and len(self._kids) == len(children):
+            if not self._dirty: return
+            dirty = sorted(self._index[child] for child in self._dirty)
+            self._dirty.clear()
+            self._kids[dirty] = self._gather([children[idx] for idx in dirty])
+            self._stale = True
+            return
+        self._dirty.clear()
+        self._kids = self._gather(children)
+        self._index = {child : idx for idx, child in enumerate(children)}
+        plain = ui.base.UIElement.distribute
+        self._plain = np.fromiter((type(child).distribute is plain for child in children), bool, count=len(children))
+        self._rects = np.zeros((0, 4), np.int64) #so every kid gets distributed
+        self._stale = True
+
+    def measure(self, children):
+        self._refresh(children)
+        col_w, row_h = self._table(self._kids[:, 0:2])
+        pad = Style.PADDING.LAYOUT_PADDING
+        return (int(col_w.sum()) + (self.cols + 1) * pad, int(row_h.sum()) + (self.rows + 1) * pad)
+    
+    def distribute(self, children, bounds):
+        pad = Style.PADDING.LAYOUT_PADDING
+        self._refresh(children)
+        if not self._stale and bounds == self._bounds: return
+        kids = self._kids
+        sizes = kids[:, 0:2]
+        col_w, row_h = self._table(sizes)
+        col_left = bounds.left + pad + np.concatenate(([0], np.cumsum(col_w + pad)[:-1]))
+        row_top = bounds.top + pad + np.concatenate(([0], np.cumsum(row_h + pad)[:-1]))
+        self.col_left, self.col_right = col_left.tolist(), (col_left + col_w).tolist()
+        self.row_top, self.row_bottom = row_top.tolist(), (row_top + row_h).tolist()
+
+        #same maths as Position.resolve, for every kid at once
+        row, col = np.divmod(np.arange(len(children)), self.cols)
+        cell_tl = np.stack((col_left[col], row_top[row]), axis=1)
+        cell_size = np.stack((col_w[col], row_h[row]), axis=1)
+        tl = cell_tl + np.trunc(cell_size * kids[:, 2:4]) - np.trunc(sizes * kids[:, 4:6]) + kids[:, 6:8]
+        rects = np.concatenate((tl, sizes), axis=1).astype(np.int64)
+
+        #only kids that moved, resized or want a reflow need telling
+        flags = np.fromiter((child._reflow_flag for child in children), bool, count=len(children))
+        changed = flags.copy()
+        if len(self._rects) == len(children): 
+            resized = (rects[:, 2:4] != self._rects[:, 2:4]).any(axis=1)
+            changed |= (rects[:, 0:2] != self._rects[:, 0:2]).any(axis=1) | resized
+        else: resized = changed = np.ones(len(children), bool)
+        old_bounds, self._rects, self._bounds, self._stale = self._bounds, rects, bounds.copy(), False
+        for idx in np.flatnonzero(changed & ~self._plain).tolist():
+            children[idx].distribute(pygame.Rect(rects[idx].tolist()))
+        #plain leaves are placed right here in bulk, which is all UIElement.distribute() does for them minus damaging each rect
+        #(the grid's old and new bounds cover every one) and the spatial grid (this strategy indexes its own kids)
+        moved = changed & self._plain
+        if not moved.any(): return
+        if moved.all(): placed, cols = children, rects.T.tolist() #a resize moves everything, skip the gathers
+        else: placed, cols = list(map(children.__getitem__, np.flatnonzero(moved).tolist())), rects[moved].T.tolist()
+        for child, x, y, w, h in zip(placed, *cols):
+            if child._rect is None: child._rect = pygame.Rect(x, y, w, h)
+            else: child._rect.update(x, y, w, h) #nothing else holds a leaf's rect, so it can move in place
+        for idx in np.flatnonzero(moved & flags).tolist(): children[idx]._reflow_flag = False
+        for idx in np.flatnonzero(moved & resized).tolist(): children[idx]._dirty = True
+        uii = children[0]._uii
+        uii.damage(old_bounds)
+        uii.damage(bounds)
+
+    def child_at(self, children, point):
+        col = bisect_right(self.col_left, point[0]) - 1
+        row = bisect_right(self.row_top, point[1]) - 1
+        if col < 0 or row < 0 or point[0] >= self.col_right[col] or point[1] >= self.row_bottom[row]: return None #in the padding
+        idx = row * self.cols + col
+        return children[idx] if idx < len(children) else None
+
+class Fenwick:
+    """prefix sums over a growable list of numbers, O(log n) updates, appends and searches"""
+    def __init__(self, values=()):
+        self.values : list[int] = []
+        self.tree : list[int] = [0] #1-indexed, tree[i] holds the sum of values (i - lowbit(i), i]
+        for value in values: self.append(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def prefix(self, n) -> int:
+        """sum of the first n values"""
+        total = 0
+        while n > 0:
+            total += self.tree[n]
+            n -= n & -n
+        return total
+    
+    def total(self) -> int:
+        return self.prefix(len(self.values))
+
+    def set(self, idx, value):
+        delta = value - self.values[idx]
+        self.values[idx] = value
+        i = idx + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def append(self, value):
+        i = len(self.values) + 1
+        self.values.append(0)
+        self.tree.append(self.prefix(i-1) - self.prefix(i - (i & -i)))
+        self.set(i-1, value)
+
+    def find(self, target) -> int:
+        """index of the value spanning target, i.e. how many values fit entirely within target"""
+        idx = 0
+        step = 1 << (len(self.values).bit_length())
+        while step:
+            if idx + step <= len(self.values) and self.tree[idx + step] <= target:
+                idx += step
+                target -= self.tree[idx]
+            step >>= 1
+        return idx
+
+class ScrollLayout(Strategy):
+    """lays out kids vertically like BoxLayout, but only the ones that intersect a fixed size viewport
+    \n keeps every kid's height (plus padding) in a Fenwick tree, so finding the first visible kid and updating a kid's height is O(log n)
+    \n children may contain None for kids that haven't been built yet, build(index) is called for them once they scroll into view,
+    and REMOVED for deleted kids, which keep their slot at zero height until the container compacts them (see ScrollContainer._compact)"""
+    REMOVED = object()
+
+    def __init__(self, viewport : tuple[int, int], item_height : int):
+        self.viewport = viewport
+        self.item_height = item_height #assumed for kids that haven't been measured yet
+        self.heights = Fenwick()
+        self.scroll = 0
+        self.build : Callable[[int], 'ui.base.UIElement'] = None
+        self.shown : list['ui.base.UIElement'] = [] #kids laid out by the last distribute, in order
+        self.showing : set['ui.base.UIElement'] = set() #the same kids, for membership tests
+
+    def content_height(self):
+        return Style.PADDING.LAYOUT_PADDING + self.heights.total()
+    
+    def measure(self, children):
+        return self.viewport
+    
+    def distribute(self, children, bounds):
+        pad = Style.PADDING.LAYOUT_PADDING
+        self.scroll = max(0, min(self.scroll, self.content_height() - bounds.height))
+        idx = self.heights.find(max(0, self.scroll - pad))
+        y = pad + self.heights.prefix(idx)
+        self.shown, self.showing = [], set()
+        while idx < len(children) and y < self.scroll + bounds.height:
+            if children[idx] is ScrollLayout.REMOVED:
+                idx += 1
+                continue
+            child = children[idx] if children[idx] is not None else self.build(idx)
+            c_w, c_h = child.measured()
+            if c_h + pad != self.heights.values[idx]: self.heights.set(idx, c_h + pad)
+            c_space = (bounds.width - 2*pad - Style.SIZES.SCROLL_BAR, c_h)
+            rc_tl = np.add((pad, y - self.scroll), child._pos.resolve((c_w, c_h), c_space))
+            self.shown.append(child) #before distributing, so the kid knows it's shown
+            self.showing.add(child)
+            child.distribute(pygame.Rect(np.add(bounds.topleft, rc_tl), (c_w, c_h)))
+            y += c_h + pad
+            idx += 1
+
+class SpatialGrid:
+    """uniform grid over screen space, maps each cell to the laid out elements whose rects overlap it
+    \n used for hit testing so finding what's under the mouse doesn't need to touch the whole tree"""
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells : dict[tuple[int, int], list['ui.base.UIElement']] = {} #lists not sets, a cell only ever holds a handful
+        self.placed : dict['ui.base.UIElement', tuple[int, int, int, int]] = {} #element -> the cell range it was indexed over
+
+    def __contains__(self, element):
+        return element in self.placed
+
+    def span(self, rect : pygame.Rect) -> tuple[int, int, int, int]:
+        """the (left, top, right, bottom) range of cells the rect overlaps, inclusive"""
+        cs = self.cell_size
+        return (rect.left // cs, rect.top // cs, (rect.right - 1) // cs, (rect.bottom - 1) // cs)
+    
+    @staticmethod
+    def cells_in(span) -> list[tuple[int, int]]:
+        left, top, right, bottom = span
+        return [(x, y) for x in range(left, right + 1) for y in range(top, bottom + 1)]
+
+    def update(self, element):
+        """(re)index the element at its current rect"""
+        self.remove(element)
+        if not element._rect: return #zero sized rects can never be hit
+        if element._parent and element._parent()._strategy.indexes_children: return #found through the parent instead
+        span = self.placed[element] = self.span(element._rect)
+        for cell in self.cells_in(span):
+            bucket = self.cells.get(cell)
+            if bucket is None: self.cells[cell] = [element]
+            else: bucket.append(element)
+
+    def remove(self, element):
+        span = self.placed.pop(element, None)
+        if span is None: return
+        for cell in self.cells_in(span):
+            bucket = self.cells[cell]
+            bucket.remove(element)
+            if not bucket: del self.cells[cell]
+
+    def query(self, point) -> list['ui.base.UIElement']:
+        """all indexed elements whose rect contains the point, in no particular order"""
+        bucket = self.cells.get((int(point[0]) // self.cell_size, int(point[1]) // self.cell_size), ())
+        return [element for element in bucket if element._rect.collidepoint(point)]
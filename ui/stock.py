@@ -1,5 +1,4 @@
-from dataclasses import dataclass
-import re
+from dataclasses import dataclass, field
 
 import numpy as np
 import pygame
@@ -11,27 +10,37 @@ import ui.style
 import ui.util
 from ui.style import Style
 
-TAG_RE = re.compile(r'<(/?)(\w+)>')
-
-@dataclass
+@dataclass(slots=True)
 class TextData:
     text: str
     size: int
     colour: tuple[int, int, int]
+    rich: ui.style.RichText = field(init=False, repr=False, compare=False) #text's markup, compiled whenever text is set
+
+    def __setattr__(self, name, value):
+        #not super(), zero argument super() breaks once dataclass rebuilds the class with slots
+        object.__setattr__(self, name, value)
+        if name == "text": object.__setattr__(self, "rich", ui.style.compile_rich(value))
 
 class TextLabel(ui.base.UIElement):
     """'rich' text with no background"""
+    __slots__ = ("textdata",)
+    sized_by_window = False
+
     def __init__(self, ui_instance, text, **kwargs):
         super().__init__(ui_instance, **kwargs)
         self.textdata = TextData(text, Style.SIZES.FONT_MED, Style.COLOURS.TEXT_NORMAL)
     def measure(self):
-        return self._uii.fonts[self.textdata.size].size(TAG_RE.sub('', self.textdata.text))
+        return self.textdata.rich.size(self._uii.fonts[self.textdata.size])
     def draw_surf(self):
-        return ui.style.bt_render(self.textdata.text, self._uii.fonts[self.textdata.size], self.textdata.colour)
+        return self.textdata.rich.render(self._uii.fonts[self.textdata.size], self.textdata.colour)
 
 class Button(ui.base.UIElement):
     """label with background that can be clicked on to call the callback\n
     callback provides 1 argument, position of mouse relative to the top left of the button"""
+    __slots__ = ("textdata", "on_click", "force_on")
+    sized_by_window = False
+
     def __init__(self, ui_instance, text: str, click_func, **kwargs):
         super().__init__(ui_instance, **kwargs)
         self.textdata = self.textdata = TextData(text, Style.SIZES.FONT_MED, Style.COLOURS.TEXT_NORMAL)
@@ -39,7 +48,8 @@ class Button(ui.base.UIElement):
         self.force_on = False
 
     def measure(self):
-        return np.add(self._uii.fonts[self.textdata.size].size(self.textdata.text), (Style.PADDING.BUTTON_PADDING*2, Style.PADDING.BUTTON_PADDING*2))
+        t_w, t_h = self._uii.fonts[self.textdata.size].size(self.textdata.text)
+        return (t_w + Style.PADDING.BUTTON_PADDING*2, t_h + Style.PADDING.BUTTON_PADDING*2)
 
     def update(self, dt):
         if self.istate.click_percent or self.istate.hover_percent:
@@ -61,6 +71,9 @@ class Button(ui.base.UIElement):
     
 class EntryBox(ui.base.UIElement):
     """button that can be clicked on and typed in. contents stored in Entrybox.textdata"""
+    __slots__ = ("default", "textdata")
+    sized_by_window = False
+
     def __init__(self, ui_instance, default_text="Type...", **kwargs):
         super().__init__(ui_instance, **kwargs)
         self.default = default_text
@@ -107,7 +120,7 @@ class EntryBox(ui.base.UIElement):
                                          self.istate.hover_percent/100)
             t_col = Style.COLOURS.TEXT_NORMAL
         result = ui.util.Graphics.coloured_square(Style.COLOURS.FOREGROUND, self._rect.size, bg_a)
-        t_surf = self._uii.fonts[self.textdata.size].render(self.textdata.text or (self.default if not self.istate.is_kb_focused else ""), True, t_col)
+        t_surf = self._uii.fonts[self.textdata.size].render(self.textdata.text or (self.default if not self.istate.is_kb_focused else ""), True, t_col).copy()
         t_surf.set_alpha(128 if not self.istate.is_kb_focused else 255)
         result.blit(t_surf, (Style.PADDING.BUTTON_PADDING, Style.PADDING.BUTTON_PADDING))
         return result
@@ -115,6 +128,9 @@ class EntryBox(ui.base.UIElement):
 class TextList(ui.base.UIElement):
     """will render max_lines (or all) lines of text in list pointed to by list_ref\n
     can be clicked on to call a function with the clicked line as an argument"""
+    __slots__ = ("list_ref", "max_lines", "click_func", "_offset", "_moused_idx")
+    sized_by_window = False
+
     def __init__(self, ui_instance, list_ref, click_func=None, max_lines=999, **kwargs):
         super().__init__(ui_instance, **kwargs)
         self.list_ref : list[str] = list_ref
@@ -126,15 +142,20 @@ class TextList(ui.base.UIElement):
     #input handling
     def while_hovered(self, translated_mouse):
         if not self.list_ref: return
-        self._moused_idx = (translated_mouse[1] - Style.PADDING.LAYOUT_PADDING) // (self._uii.fonts[Style.SIZES.FONT_MED].size(self.list_ref[0])[1] 
-                                                                                    + Style.PADDING.LAYOUT_PADDING)
+        moused_idx = (translated_mouse[1] - Style.PADDING.LAYOUT_PADDING) // (self._uii.fonts[Style.SIZES.FONT_MED].size(self.list_ref[0])[1] 
+                                                                              + Style.PADDING.LAYOUT_PADDING)
+        if moused_idx != self._moused_idx:
+            self._moused_idx = moused_idx
+            self.mark_dirty()
     def on_exit(self):
         self._moused_idx = -1
+        self.mark_dirty()
     def on_click(self, translated_mouse):
         print(self.list_ref[self._moused_idx+self._offset])
         if not self.click_func: return
         self.click_func(self._moused_idx + self._offset)
     def on_scroll(self, up, down):
+        self.mark_dirty()
         self.reflow()
         if down: self._offset = min(self._offset+1, len(self.list_ref)-self.max_lines)
         if up: self._offset = max(0, self._offset-1)
@@ -170,24 +191,111 @@ class TextList(ui.base.UIElement):
                 pygame.draw.line(result, Style.COLOURS.TEXT_HIGHLIGHTED, 
                                 (divider_start, h-(Style.PADDING.LAYOUT_PADDING)),
                                 (divider_end, h-(Style.PADDING.LAYOUT_PADDING)))
-                
-        #scrollbar 
+        return self._draw_scrollbar(result)
+    
+    def _draw_scrollbar(self, result):
         if self.max_lines >= len(self.list_ref): return result
         scr_bg = ui.util.Graphics.coloured_square(Style.COLOURS.TEXT_HIGHLIGHTED, 
                                                   (Style.SIZES.SCROLL_BAR, self._rect.height-Style.PADDING.LAYOUT_PADDING*2),
-                                                  Style.ALPHA.BUTTON_HOVER)
+                                                  Style.ALPHA.BUTTON_HOVER, copy=False)
         result.blit(scr_bg, (self._rect.width-scr_bg.width-Style.PADDING.LAYOUT_PADDING, Style.PADDING.LAYOUT_PADDING))
         
         scr = ui.util.Graphics.coloured_square(Style.COLOURS.TEXT_HIGHLIGHTED, 
                                                (Style.SIZES.SCROLL_BAR*0.8, Style.SIZES.SCROLL_BAR*0.8),
-                                                Style.ALPHA.BUTTON_ACTIVE)
+                                                Style.ALPHA.BUTTON_ACTIVE, copy=False)
         scr_percent = (self._offset)/(len(self.list_ref)-self.max_lines)
         result.blit(scr, (self._rect.width-scr_bg.width+1-Style.PADDING.LAYOUT_PADDING, 
                              (self._rect.height-2*Style.PADDING.LAYOUT_PADDING-scr.height-Style.SIZES.SCROLL_BAR*0.8)*scr_percent+Style.PADDING.LAYOUT_PADDING+Style.SIZES.SCROLL_BAR*0.4))
         return result
     
+class VirtualTextList(TextList):
+    """TextList for huge lists (anything with len() and indexing), with a fixed width and a row height measured once\n
+    scrolling never reflows: already drawn rows are shifted and only the newly exposed ones are rasterised,
+    so a scroll costs the same no matter how long list_ref is\n
+    call refresh() after changing the contents of list_ref"""
+    __slots__ = ("width", "_row_h", "_rows", "_drawn")
+
+    def __init__(self, ui_instance, list_ref, width, click_func=None, max_lines=20, **kwargs):
+        super().__init__(ui_instance, list_ref, click_func, max_lines, **kwargs)
+        self.width = width
+        self._row_h : int = None
+        self._rows : pygame.Surface = None #text of the visible rows, transparent everywhere else
+        self._drawn = None #(offset, moused_idx, len) the rows surface was drawn with
+
+    def row_height(self):
+        if self._row_h is None: self._row_h = self._uii.fonts[Style.SIZES.FONT_MED].size("Hg")[1]
+        return self._row_h
+    
+    def visible(self):
+        return min(self.max_lines, len(self.list_ref))
+    
+    def refresh(self):
+        self._drawn = None
+        self.mark_dirty(resize=True)
+
+    #input handling
+    def while_hovered(self, translated_mouse):
+        moused_idx = (translated_mouse[1] - Style.PADDING.LAYOUT_PADDING) // (self.row_height() + Style.PADDING.LAYOUT_PADDING)
+        if moused_idx != self._moused_idx:
+            self._moused_idx = moused_idx
+            self.mark_dirty()
+    def on_scroll(self, up, down):
+        offset = self._offset
+        if down: offset = min(offset+1, len(self.list_ref)-self.max_lines)
+        if up: offset = offset-1
+        offset = max(0, offset)
+        if offset != self._offset:
+            self._offset = offset
+            self.mark_dirty()
+
+    #rendering
+    def measure(self):
+        n = self.visible()
+        return (self.width, n*self.row_height() + (n+1)*Style.PADDING.LAYOUT_PADDING)
+    
+    def _draw_row(self, slot):
+        step = self.row_height() + Style.PADDING.LAYOUT_PADDING
+        self._rows.fill((0, 0, 0, 0), (0, Style.PADDING.LAYOUT_PADDING + slot*step, self._rows.width, self.row_height()))
+        if self._offset + slot >= len(self.list_ref): return
+        line = self._uii.fonts[Style.SIZES.FONT_MED].render(self.list_ref[self._offset + slot], 1, Style.COLOURS.TEXT_HIGHLIGHTED, 
+                                                            bgcolor=(Style.COLOURS.FOREGROUND_DEEMPHASISED if slot==self._moused_idx else None))
+        self._rows.blit(line, (self._rows.width/2-line.width/2, Style.PADDING.LAYOUT_PADDING + slot*step))
+
+    def _sync_rows(self):
+        """brings the rows surface up to date, only drawing the rows that changed since last time"""
+        n = self.visible()
+        if self._rows is None or self._rows.size != self._rect.size or self._drawn is None or self._drawn[2] != len(self.list_ref):
+            self._rows = pygame.Surface(self._rect.size, pygame.SRCALPHA)
+            stale = set(range(n))
+        else:
+            drawn_offset, drawn_moused, _ = self._drawn
+            shift = self._offset - drawn_offset
+            stale = set()
+            if abs(shift) >= n: stale = set(range(n))
+            elif shift:
+                self._rows.scroll(0, -shift * (self.row_height() + Style.PADDING.LAYOUT_PADDING))
+                stale = set(range(n-shift, n)) if shift > 0 else set(range(-shift))
+            if shift or drawn_moused != self._moused_idx: #the highlight moved with the content or the mouse moved
+                stale.update(slot for slot in (drawn_moused - shift, self._moused_idx) if 0 <= slot < n)
+        for slot in stale: self._draw_row(slot)
+        self._drawn = (self._offset, self._moused_idx, len(self.list_ref))
+
+    def draw_surf(self):
+        self._sync_rows()
+        result = ui.util.Graphics.coloured_square(Style.COLOURS.FOREGROUND, self._rect.size, Style.ALPHA.BUTTON_ACTIVE)
+        step = self.row_height() + Style.PADDING.LAYOUT_PADDING
+        scroll_bar = Style.SIZES.SCROLL_BAR if self.max_lines < len(self.list_ref) else 0
+        for slot in range(self.visible()-1):
+            pygame.draw.line(result, Style.COLOURS.TEXT_HIGHLIGHTED, 
+                             (Style.PADDING.LAYOUT_PADDING + scroll_bar, (slot+1)*step),
+                             (self._rect.width - Style.PADDING.LAYOUT_PADDING - scroll_bar, (slot+1)*step))
+        result.blit(self._rows, (0, 0))
+        return self._draw_scrollbar(result)
+    
 class ContextMenu(ui.base.UIContainer):
     """wrapper class to layout buttons generated when user right clicks an object that overrides UIElement.on_right()"""
+    __slots__ = ()
+
     def __init__(self, ui_instance, names_functions, **kwargs):
         super().__init__(ui_instance, ui.pos.BoxLayout(alignment="vertical"), **kwargs)
         [self.add_elements({name : ui.stock.Button(ui_instance, name, func)}) for (name, func) in names_functions]
@@ -208,8 +316,107 @@ class ContextMenu(ui.base.UIContainer):
         self._uii.remove_event_listener("lmb_up", self.del_handler)
         self._uii.remove_event_listener("resize", self.del_handler)
 
+class ScrollContainer(ui.base.UIContainer):
+    """vertically scrolling container with a fixed size viewport that only lays out and draws the children in view\n
+    children can be added up front with add_elements(), or built on demand by factory(index) for count items once they scroll into view\n
+    item_height is the height assumed for children that haven't been measured yet"""
+    __slots__ = ("factory", "_items", "_item_index", "_factory_index", "_removed")
+    clips_children = True
+
+    def __init__(self, ui_instance, size, factory=None, count=0, item_height=30, **kwargs):
+        super().__init__(ui_instance, ui.pos.ScrollLayout(size, item_height), **kwargs)
+        self.factory = factory
+        self._items : list[ui.base.UIElement] = [None] * count #in scroll order, None until built, ScrollLayout.REMOVED once deleted
+        self._item_index : dict[ui.base.UIElement, int] = {} #built kid -> its place in _items
+        self._factory_index : list[int] = None #what to pass factory() for each item once _compact() has shifted them, None till then
+        self._removed = 0 #REMOVED slots in _items
+        self._strategy.build = self._build
+        for _ in range(count): self._strategy.heights.append(item_height + Style.PADDING.LAYOUT_PADDING)
+
+    # ------ manage kids
+
+    def _build(self, idx):
+        child = self._items[idx] = self.factory(idx if self._factory_index is None else self._factory_index[idx])
+        self._item_index[child] = idx
+        super()._adopt(child._id, child)
+        return child
+
+    def _adopt(self, key, element):
+        super()._adopt(key, element)
+        self._item_index[element] = len(self._items)
+        self._items.append(element)
+        if self._factory_index is not None: self._factory_index.append(-1) #never built by the factory
+        self._strategy.heights.append(self._strategy.item_height + Style.PADDING.LAYOUT_PADDING)
+
+    def _remove_child(self, element):
+        super()._remove_child(element)
+        idx = self._item_index.pop(element)
+        #tombstoned rather than deleted, so the heights are an O(log n) update instead of a rebuild
+        self._items[idx] = ui.pos.ScrollLayout.REMOVED
+        self._strategy.heights.set(idx, 0)
+        self._strategy.shown = [child for child in self._strategy.shown if child is not element]
+        self._strategy.showing.discard(element)
+        self._removed += 1
+        if self._removed * 2 > len(self._items): self._compact()
+
+    def _compact(self):
+        """drops the REMOVED slots, O(n) but only once they're half of _items so it's amortised over the removals"""
+        keep = [idx for idx, item in enumerate(self._items) if item is not ui.pos.ScrollLayout.REMOVED]
+        origin = self._factory_index
+        self._factory_index = keep if origin is None else [origin[idx] for idx in keep]
+        self._items = [self._items[idx] for idx in keep]
+        self._item_index = {item : idx for idx, item in enumerate(self._items) if item is not None}
+        heights = self._strategy.heights.values
+        self._strategy.heights = ui.pos.Fenwick(heights[idx] for idx in keep) #removed slots were 0 high, so scroll stays put
+        self._removed = 0
+
+    def visible_children(self):
+        return self._strategy.shown
+
+    def shows(self, child):
+        return child in self._strategy.showing
+    
+    # ------ layout
+
+    def measure(self):
+        return self._strategy.measure(self._items)
+    
+    def distribute(self, rect):
+        shown = self._strategy.showing
+        relayout = self._reflow_flag or rect != self._rect
+        ui.base.UIElement.distribute(self, rect)
+        if not relayout: return
+        self._strategy.distribute(self._items, self._rect)
+        #kids that left the viewport can't be hit, kids that came back need their whole subtree hittable again
+        now_shown = self._strategy.showing
+        for child in shown - now_shown:
+            for element in self._uii.df_traverse(child): self._uii.spatial.remove(element)
+        for child in now_shown - shown:
+            for element in self._uii.df_traverse(child): 
+                if element._rect is not None and element not in self._uii.spatial: self._uii.spatial.update(element)
+
+    def on_scroll(self, up, down):
+        scroll = self._strategy.scroll + self._strategy.item_height * (1 if down else -1)
+        scroll = max(0, min(scroll, self._strategy.content_height() - self._rect.height))
+        if scroll == self._strategy.scroll: return
+        self._strategy.scroll = scroll
+        self.mark_dirty()
+        self.reflow()
+
+    def draw_surf(self):
+        result = ui.util.Graphics.coloured_square(Style.COLOURS.FOREGROUND, self._rect.size, Style.ALPHA.LAYOUT)
+        content = self._strategy.content_height()
+        if content <= self._rect.height: return result
+        thumb_h = max(Style.SIZES.SCROLL_BAR, self._rect.height**2 / content)
+        thumb = ui.util.Graphics.coloured_square(Style.COLOURS.TEXT_HIGHLIGHTED, (Style.SIZES.SCROLL_BAR, thumb_h), Style.ALPHA.BUTTON_HOVER, copy=False)
+        result.blit(thumb, (self._rect.width - Style.SIZES.SCROLL_BAR - Style.PADDING.LAYOUT_PADDING, 
+                            (self._rect.height - thumb_h) * self._strategy.scroll / (content - self._rect.height)))
+        return result
+
 class ProgressBar(ui.base.UIElement):
     """experimental"""
+    __slots__ = ("rel_width", "total", "pos")
+
     def __init__(self, ui_instance, width, total=None, **kwargs):
         super().__init__(ui_instance, **kwargs)
         self.rel_width = width / self._uii.display.width
@@ -222,20 +429,22 @@ class ProgressBar(ui.base.UIElement):
     def change(self, new):
         if new == self.pos: return
         self.pos = new
-        self.mark_dirty()
+        self.mark_overlay_dirty()
 
     def measure(self):
         return (self.rel_width * self._uii.display.width, 
                 self._uii.fonts[Style.SIZES.FONT_MED].size(self.prog_string())[1] + Style.PADDING.BUTTON_PADDING*2 + Style.PADDING.LAYOUT_PADDING*2)
     
     def draw_surf(self):
-        res = ui.util.Graphics.coloured_square(Style.COLOURS.FOREGROUND, self._rect.size, Style.ALPHA.LAYOUT)
+        return ui.util.Graphics.coloured_square(Style.COLOURS.FOREGROUND, self._rect.size, Style.ALPHA.LAYOUT, copy=False)
+
+    def draw_overlay(self, surface):
+        #the bar and its text change with every change(), so they go over the cached background
         try: prog = (self.pos/self.total)
         except ZeroDivisionError: prog = self._rect.width
         prog = ui.util.Graphics.coloured_square(Style.COLOURS.FOREGROUND, 
                                                 np.multiply(self._rect.size, (min(prog,1), 1)), 
-                                                Style.ALPHA.BUTTON_ACTIVE)
-        res.blit(prog, (0,0))
+                                                Style.ALPHA.BUTTON_ACTIVE, copy=False)
+        surface.blit(prog, self._rect.topleft)
         t = self._uii.fonts[Style.SIZES.FONT_MED].render(self.prog_string(), True, Style.COLOURS.TEXT_INPUT)
-        res.blit(t, (res.width/2 - t.width/2, Style.PADDING.BUTTON_PADDING+Style.PADDING.LAYOUT_PADDING))
-        return res
\ No newline at end of file
+        surface.blit(t, (self._rect.left + self._rect.width/2 - t.width/2, self._rect.top + Style.PADDING.BUTTON_PADDING+Style.PADDING.LAYOUT_PADDING))
\ No newline at end of file
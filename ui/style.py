@@ -1,5 +1,8 @@
-import pygame
+import functools
 import re
+
+import pygame
+
 TAG_RE = re.compile(r'<(/?)(\w+)>')
 
 class Style:
@@ -49,18 +52,52 @@ EFFECT_MAP = {
     "st" : "strikethrough"
 }
 
-def bt_render(text:str, font:pygame.Font, default_colour=Style.COLOURS.TEXT_NORMAL) -> pygame.Surface:
+class RichText:
+    """markup compiled into runs of (segment, style), built by compile_rich() and shared by every label with the same markup
+    \n a style is (colour or None for the label's default, bold, italic, underline, strikethrough)
+    \n run widths are worked out once per font and remembered"""
+    __slots__ = ("runs", "plain", "_widths")
+
+    def __init__(self, runs : tuple[tuple[str, tuple], ...]):
+        self.runs = runs
+        self.plain = "".join(segment for segment, _ in runs)
+        self._widths : dict[tuple, tuple[int, ...]] = {}
+
+    def widths(self, font) -> tuple[int, ...]:
+        """width of every run in font (a ui.util.Wrappers.CachedFont)"""
+        if (widths := self._widths.get(font.key)) is None:
+            widths = self._widths[font.key] = tuple(font.size(segment, style[1:])[0] for segment, style in self.runs)
+        return widths
+    
+    def size(self, font) -> tuple[int, int]:
+        return (sum(self.widths(font)), font.get_height())
+    
+    def render(self, font, default_colour=Style.COLOURS.TEXT_NORMAL) -> pygame.Surface:
+        result = pygame.Surface(self.size(font), pygame.SRCALPHA)
+        pos_x = 0
+        for (segment, style), width in zip(self.runs, self.widths(font)):
+            result.blit(font.render(segment, True, style[0] or default_colour, style=style[1:]), (pos_x, 0))
+            pos_x += width
+        return result
+
+@functools.lru_cache(maxsize=4096)
+def compile_rich(text : str) -> RichText:
+    """tokenises markup like <b>bold</b> or <r>red</r> into a RichText, identical markup compiles to the same object"""
     pos = 0
     stack = []
-    current_style = {'color': default_colour, 'bold': False, 'italic': False, 'underline': False, 'strikethrough' : False}
+    current_style = {'color': None, 'bold': False, 'italic': False, 'underline': False, 'strikethrough' : False}
     output = []
 
+    def flush(segment):
+        output.append((segment, (current_style['color'], current_style['bold'], current_style['italic'], 
+                                 current_style['underline'], current_style['strikethrough'])))
+
     for match in TAG_RE.finditer(text):
         start, end = match.span()
         tag_open, tag_name = match.groups()
 
         if start > pos:
-            output.append((text[pos:start], current_style.copy()))
+            flush(text[pos:start])
 
         if tag_open == '':
             if tag_name in COLOR_MAP:
@@ -71,8 +108,6 @@ def bt_render(text:str, font:pygame.Font, default_colour=Style.COLOURS.TEXT_NORM
                 stack.append((attr, current_style[attr]))
                 current_style[attr] = True
         else:
-            if tag_name in COLOR_MAP or tag_name in EFFECT_MAP:
-                attr = 'color' if tag_name in COLOR_MAP else EFFECT_MAP[tag_name]
             if stack:
                 attr, prev_val = stack.pop()
                 current_style[attr] = prev_val
@@ -80,17 +115,9 @@ def bt_render(text:str, font:pygame.Font, default_colour=Style.COLOURS.TEXT_NORM
         pos = end
 
     if pos < len(text):
-        output.append((text[pos:], current_style.copy()))
-
-    result = pygame.Surface(font.size(TAG_RE.sub('', text)), pygame.SRCALPHA)
-    pos_x = 0
-    for segment, style in output:
-        font.set_bold(style['bold']) 
-        font.set_italic(style['italic'])
-        font.set_underline(style['underline'])
-        font.set_strikethrough(style['strikethrough'])
-        surface = font.render(segment, True, style['color'])
-        result.blit(surface, (pos_x, 0))
-        pos_x += surface.get_width()
-    
-    return result
\ No newline at end of file
+        flush(text[pos:])
+    return RichText(tuple(output))
+
+def bt_render(text:str, font, default_colour=Style.COLOURS.TEXT_NORMAL) -> pygame.Surface:
+    """renders markup with a ui.util.Wrappers.CachedFont"""
+    return compile_rich(text).render(font, default_colour)
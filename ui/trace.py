@@ -0,0 +1,124 @@
+import functools
+import json
+import time
+from typing import TYPE_CHECKING
+
+import ui.base
+if TYPE_CHECKING: import ui.core
+
+class Tracer:
+    """opt-in per-element cost attribution, records a span for every measure(), distribute(), draw_surf(), draw_overlay() and render() call
+    \n nothing is instrumented until start(), the methods of every UIElement subclass are wrapped in place and put back by stop(),
+    so there's no overhead at all while not tracing. classes defined after start() aren't traced
+    \n spans are tagged with the element's class, key path and _id, render's own time (what's left once draw_surf and draw_overlay are taken out) is its blit"""
+    KINDS = ("measure", "distribute", "draw_surf", "draw_overlay", "render")
+
+    def __init__(self, ui_instance : 'ui.core.UIEngine'):
+        self._uii = ui_instance
+        self.spans : list[tuple] = [] #(name, category, start ns, duration ns, exclusive ns, frame, args)
+        self.frame = 0
+        self._frames_left = None
+        self._open : list[list[int]] = [] #child time of every span still running, innermost last
+        self._patched : list[tuple[type, str, object]] = []
+
+    @property
+    def enabled(self):
+        return bool(self._patched)
+
+    def start(self, frames : int = None):
+        """begins recording, stopping by itself after frames ticks if given"""
+        if self.enabled: return
+        self.spans = []
+        self.frame = 0
+        self._frames_left = frames
+        classes = [ui.base.UIElement]
+        for cls in classes: classes.extend(cls.__subclasses__())
+        for cls in dict.fromkeys(classes): #a class can be reached through more than one parent
+            for kind in Tracer.KINDS:
+                if kind in vars(cls): self._patch(cls, kind, self._element_span(kind, vars(cls)[kind]))
+        for phase in ("handle_events", "update", "handle_reflow", "render", "cleanup"):
+            self._patch(self._uii, phase, self._phase_span(phase, getattr(self._uii, phase)))
+        self._patch(self._uii, "tick", self._tick(self._uii.tick))
+
+    def stop(self):
+        """puts every wrapped method back"""
+        for owner, name, original in reversed(self._patched):
+            if original is None: delattr(owner, name) #was only an instance attribute for the duration
+            else: setattr(owner, name, original)
+        self._patched = []
+        self._open = []
+
+    # ------ instrumentation
+
+    def _patch(self, owner, name, wrapper):
+        self._patched.append((owner, name, vars(owner)[name] if isinstance(owner, type) else None))
+        setattr(owner, name, wrapper)
+
+    def _span(self, name, category, args, func, *call_args):
+        self._open.append([0])
+        start = time.perf_counter_ns()
+        try: return func(*call_args)
+        finally:
+            duration = time.perf_counter_ns() - start
+            children = self._open.pop()[0]
+            if self._open: self._open[-1][0] += duration
+            self.spans.append((name, category, start, duration, duration - children, self.frame, args))
+
+    def _element_span(self, kind, method):
+        @functools.wraps(method)
+        def wrapper(element, *args):
+            return self._span(f"{type(element).__name__}.{kind}", kind,
+                              (type(element).__name__, Tracer.key_path(element), element._id), method, element, *args)
+        return wrapper
+
+    def _phase_span(self, phase, method):
+        @functools.wraps(method)
+        def wrapper():
+            return self._span(phase, "phase", None, method)
+        return wrapper
+
+    def _tick(self, tick):
+        @functools.wraps(tick)
+        def wrapper():
+            self._span(f"frame {self.frame}", "frame", None, tick)
+            self.frame += 1
+            if self._frames_left is not None:
+                self._frames_left -= 1
+                if self._frames_left <= 0: self.stop()
+        return wrapper
+
+    @staticmethod
+    def key_path(element : 'ui.base.UIElement') -> str:
+        """the keys leading from the root down to the element, like "stress/15" """
+        keys = []
+        while element._parent and (parent := element._parent()):
+            keys.append(str(parent._child_key.get(element, "?")))
+            element = parent
+        return "/".join(reversed(keys))
+
+    # ------ results
+
+    def top(self, n=10) -> list[dict]:
+        """the n elements that cost the most exclusive time over the recording, with their time split by kind"""
+        totals = {}
+        for _, category, _, _, exclusive, _, args in self.spans:
+            if args is None: continue
+            entry = totals.setdefault(args, {"class" : args[0], "path" : args[1], "id" : args[2], "total_ms" : 0.0, "calls" : 0})
+            entry["total_ms"] += exclusive / 1e6
+            entry[f"{category}_ms"] = entry.get(f"{category}_ms", 0.0) + exclusive / 1e6
+            entry["calls"] += 1
+        return sorted(totals.values(), key=lambda entry: entry["total_ms"], reverse=True)[:n]
+
+    def report(self, n=10) -> str:
+        lines = [f"{self.frame} frames traced, most expensive elements by exclusive time:"]
+        for entry in self.top(n):
+            kinds = ", ".join(f"{kind} {entry[f'{kind}_ms']:.3f}" for kind in Tracer.KINDS if f"{kind}_ms" in entry)
+            lines.append(f"{entry['total_ms']:>9.3f} ms  {entry['class']} '{entry['path']}' #{entry['id']} ({entry['calls']} calls: {kinds})")
+        return "\n".join(lines)
+
+    def export_chrome(self, path : str):
+        """writes the recording as Chrome trace event JSON, open it in chrome://tracing or ui.perfetto.dev"""
+        events = [{"name" : name, "cat" : category, "ph" : "X", "ts" : start / 1000, "dur" : duration / 1000, "pid" : 0, "tid" : 0,
+                   "args" : {"frame" : frame} if args is None else {"frame" : frame, "class" : args[0], "path" : args[1], "id" : args[2]}}
+                  for name, category, start, duration, _, frame, args in self.spans]
+        with open(path, "w") as f: json.dump({"traceEvents" : events, "displayTimeUnit" : "ms"}, f)
@@ -1,6 +1,17 @@
+import functools
+import heapq
+import itertools
+import multiprocessing
+import os
+import queue
 import threading
+from collections import OrderedDict
+from collections.abc import Coroutine
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
 from typing import Callable
 
+import numpy as np
 import pygame
 
 from ui.style import Style
@@ -22,6 +33,48 @@ class Exceptions:
         """Error happened while rendering pygame surface"""
         pass
 
+class Caches:
+    class LRU:
+        """least recently used cache bounded by the total size of its values rather than how many there are"""
+        def __init__(self, budget : int, sizeof : Callable = lambda value: 1):
+            self.budget = budget
+            self.sizeof = sizeof
+            self.used = 0
+            self.hits = self.misses = self.evictions = 0
+            self._items : OrderedDict = OrderedDict() #key -> (value, size), oldest first
+
+        def __len__(self):
+            return len(self._items)
+        
+        def __contains__(self, key):
+            return key in self._items
+
+        def get(self, key, factory : Callable):
+            """returns the value cached under key, building it with factory() on a miss"""
+            if (item := self._items.get(key)) is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            self.misses += 1
+            value = factory()
+            size = self.sizeof(value)
+            if size > self.budget: return value #would evict everything else for nothing
+            self._items[key] = (value, size)
+            self.used += size
+            while self.used > self.budget:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.used -= evicted
+                self.evictions += 1
+            return value
+        
+        def clear(self):
+            self._items.clear()
+            self.used = 0
+
+        def stats(self) -> dict[str, int]:
+            return {"hits" : self.hits, "misses" : self.misses, "evictions" : self.evictions, 
+                    "entries" : len(self._items), "bytes" : self.used}
+
 class Graphics:
     def rgb_from_key(key: int) -> tuple[int, int, int]:
         r = (key >> 16) & 0xFF
@@ -38,34 +91,322 @@ class Graphics:
             for i in range(3)
         )    
     
-    def coloured_square(colour : tuple[int, int, int], size : tuple[int, int], alpha:int=None):
+    def merge_rects(rects) -> list[pygame.Rect]:
+        """collapses overlapping rects into their unions so no region gets composited twice"""
+        merged = []
+        for rect in rects:
+            rect = rect.copy()
+            while (idx := rect.collidelist(merged)) != -1:
+                rect.union_ip(merged.pop(idx))
+            merged.append(rect)
+        return merged
+    
+    def surface_bytes(surface : pygame.Surface) -> int:
+        return surface.get_pitch() * surface.get_height()
+    
+    square_cache = Caches.LRU(32 * 1024 * 1024, surface_bytes)
+
+    def coloured_square(colour : tuple[int, int, int], size : tuple[int, int], alpha:int=None, copy=True):
+        """rounded rect background, rasterised once per (colour, size, alpha) and kept in Graphics.square_cache
+        \n pass copy=False when the result is only blitted and never drawn on, to skip copying the cached surface"""
+        size = (int(size[0]), int(size[1]))
+        alpha = int(alpha) if alpha is not None else None
+        result = Graphics.square_cache.get((tuple(colour), size, alpha, Style.PADDING.CORNER_RADIUS), 
+                                           lambda: Graphics._draw_square(colour, size, alpha))
+        return result.copy() if copy else result
+
+    def _draw_square(colour, size, alpha):
         result = pygame.Surface(size, pygame.SRCALPHA if alpha is not None else 0)
         if alpha is not None:
             colour = [*colour, alpha]
         pygame.draw.rect(result, colour, ((0,0), size), border_radius=Style.PADDING.CORNER_RADIUS)
         return result
 
+    def draw_columns(surface : pygame.Surface, tops : np.ndarray, bottoms : np.ndarray, colour : tuple[int, int, int]):
+        """fills every column x of an SRCALPHA surface from tops[x] down to bottoms[x] (exclusive, in pixels) with a couple of numpy operations, 
+        in place of a draw.line per column
+        \n whole pixel ends give hard edges, fractional ones are antialiased by blending the end pixels by how much of them the span covers"""
+        tops, bottoms = np.asarray(tops, np.float32), np.asarray(bottoms, np.float32)
+        #whole pixels, as one select over the surface in memory order (rows), the alpha's part of the mapped colour
+        pixels = pygame.surfarray.pixels2d(surface).T
+        y = np.arange(surface.height, dtype=np.float32)[:, None]
+        pixels[...] = np.where((y >= np.ceil(tops)) & (y < np.floor(bottoms)), np.uint32(surface.map_rgb(colour) & 0xFFFFFFFF), pixels)
+        del pixels
+        #partly covered end pixels, blended "over" what's there
+        x = np.arange(len(tops))
+        top_pixel, bottom_pixel = np.floor(tops), np.floor(bottoms)
+        ends = ((top_pixel, np.minimum(bottoms, top_pixel + 1) - tops, tops % 1 > 0),
+                (bottom_pixel, bottoms - np.maximum(tops, bottom_pixel), (bottoms % 1 > 0) & (bottom_pixel > top_pixel)))
+        rgb, alphas = pygame.surfarray.pixels3d(surface), pygame.surfarray.pixels_alpha(surface)
+        for pixel, cover, partial in ends:
+            partial &= (pixel >= 0) & (pixel < surface.height)
+            xs, ys, cover = x[partial], pixel[partial].astype(int), cover[partial]
+            blended = cover + alphas[xs, ys] / 255 * (1 - cover)
+            weight = np.divide(cover, blended, out=np.zeros_like(cover), where=blended > 0)[:, None]
+            rgb[xs, ys] = rgb[xs, ys] + (np.asarray(colour, np.float32) - rgb[xs, ys]) * weight + 0.5
+            alphas[xs, ys] = blended * 255 + 0.5
+
+class Pools:
+    class IdPool:
+        """hands out unique element ids in O(1), recycling released ones before issuing new ones
+        \n ids are packed rgb keys with every channel in 0-96 so Graphics.rgb_from_key() gives each element a debug colour"""
+        CHANNEL = 97
+        SPACE = CHANNEL ** 3
+        STRIDE = 564031 #coprime with SPACE, so stepping by it visits every colour once while scattering neighbouring ids
+
+        def __init__(self):
+            self.issued = 0
+            self.free : list[int] = []
+
+        def allocate(self) -> int:
+            if self.free: return self.free.pop()
+            if self.issued == self.SPACE: raise Exceptions.UIException("Ran out of unique element ids!")
+            idx = (self.issued * self.STRIDE) % self.SPACE
+            self.issued += 1
+            r, rem = divmod(idx, self.CHANNEL ** 2)
+            g, b = divmod(rem, self.CHANNEL)
+            return r << 16 | g << 8 | b
+        
+        def release(self, key : int):
+            """hand back the id of an element that's been deleted"""
+            self.free.append(key)
+
+    class WorkerPool:
+        """fixed number of daemon worker threads running submitted jobs, highest priority first (fifo among equals)
+        \n every job gets a concurrent.futures.Future, once it finishes (or is cancelled before starting) 
+        the future is put on the thread safe `completed` queue and notify() is called from whichever thread finished it"""
+        def __init__(self, workers=4, notify : Callable = None):
+            self.notify = notify
+            self.completed : queue.SimpleQueue[Future] = queue.SimpleQueue()
+            self._jobs : queue.PriorityQueue = queue.PriorityQueue() #(-priority, submission order, future, func, args)
+            self._order = itertools.count()
+            self._closed = False
+            self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+            for worker in self._workers: worker.start()
+
+        def submit(self, func : Callable, args=(), priority=0) -> Future:
+            if self._closed: raise RuntimeError("cannot submit jobs after shutdown")
+            future = Future()
+            future.add_done_callback(self._finished)
+            self._jobs.put((-priority, next(self._order), future, func, args))
+            return future
+
+        def shutdown(self):
+            """cancels every job that hasn't started and lets the threads exit once they finish their current one, safe to call twice"""
+            if self._closed: return
+            self._closed = True
+            while True:
+                try: _, _, future, _, _ = self._jobs.get_nowait()
+                except queue.Empty: break
+                future.cancel()
+            for _ in self._workers: self._jobs.put((float("inf"), next(self._order), None, None, None)) #sorts after any job
+        
+        def _finished(self, future):
+            self.completed.put(future)
+            if self.notify: self.notify()
+
+        def _work(self):
+            while True:
+                _, _, future, func, args = self._jobs.get()
+                if future is None: return #shut down
+                if not future.set_running_or_notify_cancel(): continue #cancelled while queued
+                try: future.set_result(func(*args))
+                except Exception as e: future.set_exception(e)
+
+    class ProcessPool:
+        """runs submitted jobs in worker processes, for cpu bound work that would otherwise hold the GIL away from the ui
+        \n like WorkerPool jobs start highest priority first and finished futures go on the `completed` queue, 
+        which can be shared with a WorkerPool to drain both at once. func, args and the result have to be picklable
+        \n numpy arrays anywhere in the result (including inside tuples, lists and dicts) come back through shared memory
+        instead of being pickled, the future's result holds arrays mapping the worker's copy directly
+        \n the processes are spawned on the first submit, so scripts using this need an `if __name__ == "__main__"` guard"""
+        def __init__(self, workers : int = None, notify : Callable = None, completed : queue.SimpleQueue = None):
+            self.workers = workers or multiprocessing.cpu_count()
+            self.notify = notify
+            self.completed : queue.SimpleQueue[Future] = queue.SimpleQueue() if completed is None else completed
+            self._executor : ProcessPoolExecutor = None
+            self._waiting : list = [] #heap of (-priority, submission order, future, func, args) not handed to a process yet
+            self._running = 0
+            self._order = itertools.count()
+            self._lock = threading.Lock()
+            self._closed = False
+
+        _held : list[SharedMemory] = [] #worker side, see _share()
+
+        def submit(self, func : Callable, args=(), priority=0) -> Future:
+            if self._closed: raise RuntimeError("cannot submit jobs after shutdown")
+            future = Future()
+            future.add_done_callback(self._finished)
+            with self._lock: heapq.heappush(self._waiting, (-priority, next(self._order), future, func, args))
+            self._dispatch()
+            return future
+        
+        def shutdown(self):
+            """cancels every job that hasn't started, jobs already in a process finish but their shared memory is unlinked 
+            instead of attached and their futures get a CancelledError. safe to call twice"""
+            with self._lock:
+                self._closed = True
+                waiting, self._waiting = self._waiting, []
+            for _, _, future, _, _ in waiting: future.cancel()
+            if self._executor is not None: self._executor.shutdown(wait=False, cancel_futures=True)
+
+        def _finished(self, future):
+            self.completed.put(future)
+            if self.notify: self.notify()
+
+        def _dispatch(self):
+            """hands waiting jobs to the executor, only as many as there are processes so priorities still mean something"""
+            started = []
+            with self._lock:
+                if self._closed: return
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+                while self._waiting and self._running < self.workers:
+                    _, _, future, func, args = heapq.heappop(self._waiting)
+                    if not future.set_running_or_notify_cancel(): continue #cancelled while waiting
+                    self._running += 1
+                    started.append((self._executor.submit(Pools.ProcessPool._run, func, args), future))
+            #outside the lock, a job that's already done runs _resolve right here and that takes the lock too
+            for job, future in started: job.add_done_callback(functools.partial(self._resolve, future))
+
+        def _resolve(self, future : Future, job : Future):
+            with self._lock: self._running -= 1
+            try: 
+                if self._closed: 
+                    Pools.ProcessPool._release(job.result()) #nobody's left to read it, don't leave the blocks behind
+                    future.set_exception(CancelledError())
+                else: future.set_result(Pools.ProcessPool._attach(job.result()))
+            except Exception as e: future.set_exception(e)
+            self._dispatch()
+
+        @staticmethod
+        def _run(func, args):
+            """worker side, calls the job and moves any arrays in its result into shared memory"""
+            result = func(*args)
+            while Pools.ProcessPool._held: Pools.ProcessPool._held.pop().close()
+            return Pools.ProcessPool._share(result)
+
+        @staticmethod
+        def _share(value):
+            if isinstance(value, np.ndarray):
+                segment = SharedMemory(create=True, size=max(1, value.nbytes))
+                np.ndarray(value.shape, value.dtype, buffer=segment.buf)[...] = value
+                #posix keeps the block until the parent unlinks it, windows frees it with the last handle so hold on to it
+                #until this worker's next job has run, by then the parent's long since mapped it
+                if os.name == "nt": Pools.ProcessPool._held.append(segment)
+                else: segment.close()
+                return Pools.SharedArray(segment.name, value.shape, value.dtype.str)
+            if isinstance(value, (tuple, list)): return type(value)(Pools.ProcessPool._share(item) for item in value)
+            if isinstance(value, dict): return {key : Pools.ProcessPool._share(item) for key, item in value.items()}
+            return value
+
+        @staticmethod
+        def _attach(value):
+            if isinstance(value, Pools.SharedArray): return value.attach()
+            if isinstance(value, (tuple, list)): return type(value)(Pools.ProcessPool._attach(item) for item in value)
+            if isinstance(value, dict): return {key : Pools.ProcessPool._attach(item) for key, item in value.items()}
+            return value
+
+        @staticmethod
+        def _release(value):
+            if isinstance(value, Pools.SharedArray): value.release()
+            elif isinstance(value, (tuple, list)): 
+                for item in value: Pools.ProcessPool._release(item)
+            elif isinstance(value, dict): 
+                for item in value.values(): Pools.ProcessPool._release(item)
+
+    class SharedArray:
+        """an array a worker process left in a shared memory block, sent back in place of the array itself"""
+        def __init__(self, name : str, shape : tuple, dtype : str):
+            self.name, self.shape, self.dtype = name, shape, dtype
+
+        def attach(self) -> np.ndarray:
+            """maps the block into this process as an array, the block is freed once that array and every view of it are gone"""
+            self.segment = SharedMemory(self.name)
+            self.segment.unlink() #only drops the name, the memory stays while it's mapped
+            #numpy only gets the address, so nothing holds a buffer export that would stop the segment closing when this is collected
+            probe = np.frombuffer(self.segment.buf, np.uint8)
+            self.__array_interface__ = {"shape" : self.shape, "typestr" : self.dtype, "data" : (probe.ctypes.data, False), "version" : 3}
+            del probe
+            return np.asarray(self) #keeps self (and the segment) alive as its base
+
+        def release(self):
+            """frees the block without ever mapping it as an array"""
+            segment = SharedMemory(self.name)
+            segment.unlink()
+            segment.close()
+
 class Wrappers:
     class FontWrapper(dict):
         """can store the UI font at multiple sizes"""
         def __missing__(self, key):
-            self[key] = pygame.Font("ui/assets/LiberationMono-Regular.ttf", key)
+            self[key] = Wrappers.CachedFont(Style.FONTS.MONOSPACE, key)
             return self[key]
         
-        def __getitem__(self, key) -> pygame.Font:
+        def __getitem__(self, key) -> 'Wrappers.CachedFont':
             return super().__getitem__(key)
         
-    class ThreadWrapper(threading.Thread):
-        def __init__(self, target : Callable, args=(), callback=None):
-            super().__init__()
-            self._target : Callable = target
-            self._args : tuple = args
-            self.callback : Callable = callback
-            self.result = None
-            self.error = None
-
-        def run(self):
-            try:
-                self.result = self._target(*self._args)
-            except Exception as e:
-                self.error = e
\ No newline at end of file
+    class CachedFont:
+        """stands in for a pygame.Font, memoizing size() and render() across every font in the program
+        \n metrics and rasters are cached separately so measuring text never rasterises it
+        \n rendered surfaces are shared, copy them before drawing on them or changing their alpha
+        \n style is an optional (bold, italic, underline, strikethrough) tuple overriding the font's own, 
+        only applied to the font on a cache miss so cached text never touches shared font state"""
+        metrics = Caches.LRU(65536) #bounded by entry count, each is just a tuple
+        rasters = Caches.LRU(32 * 1024 * 1024, Graphics.surface_bytes)
+        FIELDS = ("font", "key")
+
+        def __init__(self, path : str, size : int):
+            self.font = pygame.Font(path, size)
+            self.key = (path, size)
+
+        def __getattr__(self, name):
+            return getattr(self.font, name)
+
+        def __setattr__(self, name, value):
+            """writes go to the wrapped font too (font.bold = True), except the wrapper's own fields"""
+            if name in Wrappers.CachedFont.FIELDS: object.__setattr__(self, name, value)
+            else: setattr(self.font, name, value)
+
+        def style(self) -> tuple[bool, bool, bool, bool]:
+            return (self.font.bold, self.font.italic, self.font.underline, self.font.strikethrough)
+
+        def size(self, text : str, style : tuple[bool, bool, bool, bool] = None) -> tuple[int, int]:
+            style = style or self.style()
+            key = (*self.key, text, style[0], style[1])
+            return Wrappers.CachedFont.metrics.get(key, lambda: self._styled(style, self.font.size, text))
+        
+        def render(self, text : str, antialias, color, bgcolor=None, style : tuple[bool, bool, bool, bool] = None) -> pygame.Surface:
+            style = style or self.style()
+            key = (*self.key, text, tuple(color), tuple(bgcolor) if bgcolor is not None else None, bool(antialias), *style)
+            return Wrappers.CachedFont.rasters.get(key, lambda: self._styled(style, self.font.render, text, antialias, color, bgcolor))
+        
+        def _styled(self, style, func, *args):
+            """calls func(*args) with the font temporarily set to style"""
+            previous = self.style()
+            self.font.bold, self.font.italic, self.font.underline, self.font.strikethrough = style
+            try: return func(*args)
+            finally: self.font.bold, self.font.italic, self.font.underline, self.font.strikethrough = previous
+
+    class CountedCoroutine(Coroutine):
+        """passes everything through to coro, adding 1 to steps[0] every time it's resumed
+        \n asyncio tasks accept any collections.abc.Coroutine, so wrapping every task's coroutine in one counts how much work the loop did"""
+        __slots__ = ("coro", "steps")
+
+        def __init__(self, coro : Coroutine, steps : list[int]):
+            self.coro = coro
+            self.steps = steps
+
+        def send(self, value):
+            self.steps[0] += 1
+            return self.coro.send(value)
+
+        def throw(self, *args):
+            self.steps[0] += 1
+            return self.coro.throw(*args)
+
+        def close(self):
+            return self.coro.close()
+
+        def __await__(self):
+            return self.coro.__await__()